@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Microbenchmarks of the helper.py text utilities against their previous implementations.
+
+    python bench_helper.py
+"""
+import re
+import timeit
+
+from helper import domain_detector, extract_number_only, image_output, remove_unicode_char, remove_white_spaces
+from text_normalize import remove_unicode_char_many, remove_white_spaces_many
+
+AD_LINK = 'https://suchen.mobile.de/fahrzeuge/auto-inserat/mercedes-benz-c-180-avantgarde/366683071.html?ref=srp'
+FEATURES = ['  Navigationssystem ', 'LED-Scheinwerfer\n', 'Sitzheizung  vorne', 'Einparkhilfe  hinten & vorne',
+            'Klimaautomatik (2-Zonen)', 'Anhängerkupplung', 'Lederausstattung \t schwarz', 'Tempomat'] * 10
+SPEC = 'Kilometerstand:  12.500 km  •  Erstzulassung 03/2021 • Leistung 150 kW (204 PS)'
+
+
+def old_image_output(images_index):
+    return re.findall('[\\.,-]?(\\d+)', images_index)
+
+
+def old_domain_detector(ad_link):
+    if re.search('.*?(mobile\\.de)/', ad_link):
+        return 'SuchenMobileDe'
+    elif re.search('.*?(autoscout24\\.de)/', ad_link):
+        return 'AutoScout24De'
+
+
+def old_remove_white_spaces(input_string):
+    return re.sub(r'\s+', ' ', input_string).strip()
+
+
+def old_remove_unicode_char(input_string):
+    return (''.join([i if ord(i) < 128 else ' ' for i in input_string])).strip()
+
+
+def old_extract_number_only(input_string):
+    numbers = re.findall(r'\d+(?:\.\d+)?', input_string)
+    return numbers if numbers else 0
+
+
+CASES = [
+    ('image_output', lambda: old_image_output('1,2,3,5,8,13'), lambda: image_output('1,2,3,5,8,13')),
+    ('domain_detector', lambda: old_domain_detector(AD_LINK), lambda: domain_detector(AD_LINK)),
+    ('remove_white_spaces', lambda: [old_remove_white_spaces(f) for f in FEATURES],
+     lambda: [remove_white_spaces(f) for f in FEATURES]),
+    ('remove_white_spaces_many', lambda: [old_remove_white_spaces(f) for f in FEATURES],
+     lambda: remove_white_spaces_many(FEATURES)),
+    ('remove_unicode_char', lambda: old_remove_unicode_char(SPEC), lambda: remove_unicode_char(SPEC)),
+    ('remove_unicode_char_many', lambda: [old_remove_unicode_char(f) for f in FEATURES],
+     lambda: remove_unicode_char_many(FEATURES)),
+    ('extract_number_only', lambda: old_extract_number_only(SPEC), lambda: extract_number_only(SPEC)),
+]
+
+
+def check():
+    assert old_image_output('1,2,3,5,8,13') == image_output('1,2,3,5,8,13')
+    assert old_domain_detector(AD_LINK) == domain_detector(AD_LINK)
+    assert [old_remove_white_spaces(f) for f in FEATURES] == remove_white_spaces_many(FEATURES)
+    assert [old_remove_unicode_char(f) for f in FEATURES] == remove_unicode_char_many(FEATURES)
+    assert old_remove_unicode_char(SPEC) == remove_unicode_char(SPEC)
+    assert old_extract_number_only(SPEC) == extract_number_only(SPEC)
+
+
+def main(number=20000):
+    check()
+    print(f"{'function':<26}{'old µs':>10}{'new µs':>10}{'speedup':>10}")
+    for name, old, new in CASES:
+        old_time = min(timeit.repeat(old, number=number, repeat=3)) / number * 1e6
+        new_time = min(timeit.repeat(new, number=number, repeat=3)) / number * 1e6
+        print(f'{name:<26}{old_time:>10.2f}{new_time:>10.2f}{old_time / new_time:>9.1f}x')
+
+
+if __name__ == "__main__":
+    main()
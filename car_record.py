@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+import json
+from dataclasses import dataclass, fields
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+@dataclass(slots=True)
+class CarRecord:
+    """
+    Typed, slotted replacement for the scraped car_data dict, validated once when the item is scraped.
+    Supports car['key'] and car.get('key') so it can be handed to PdfGenerator as api_data.
+    """
+    car_id: str
+    car_price: str = '0'
+    car_images: tuple = ()
+    car_features: tuple = ()
+    car_specifications: tuple = ()
+    job_id: str = None
+
+    def __post_init__(self):
+        self.car_id = str(self.car_id).strip()
+        if not self.car_id:
+            raise ValueError('car_id is empty')
+
+        self.car_price = str(self.car_price).replace(',', '').strip() or '0'
+        try:
+            float(self.car_price)
+        except ValueError:
+            raise ValueError(f'car_price is not a number: {self.car_price!r}')
+
+        self.car_images = tuple(str(img) for img in self.car_images)
+        self.car_features = tuple(str(feature) for feature in self.car_features)
+
+        specifications = []
+        for row in self.car_specifications:
+            if len(row) != 2:
+                raise ValueError(f'car_specifications row must be (label, value): {row!r}')
+            specifications.append((str(row[0]), str(row[1])))
+        self.car_specifications = tuple(specifications)
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    @classmethod
+    def from_dict(cls, car_data):
+        names = {f.name for f in fields(cls)}
+        return cls(**{k: v for k, v in car_data.items() if k in names})
+
+    def to_dict(self):
+        return {f.name: getattr(self, f.name) for f in fields(self)}
+
+    def dumps(self):
+        return dumps(self)
+
+    @classmethod
+    def loads(cls, data):
+        return cls(*_loads(data))
+
+
+def dumps(record):
+    """
+    Serialize a record as a compact positional array (no repeated key names), orjson when available
+    """
+    row = [getattr(record, f.name) for f in fields(record)]
+    if orjson is not None:
+        return orjson.dumps(row)
+    return json.dumps(row, separators=(',', ':')).encode()
+
+
+def _loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps_many(records):
+    return b'\n'.join(dumps(record) for record in records)
+
+
+def loads_many(data):
+    return [CarRecord.loads(line) for line in data.splitlines() if line]
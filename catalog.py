@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.platypus import BaseDocTemplate, NextPageTemplate, PageBreak
+from reportlab.platypus.doctemplate import ActionFlowable
+
+from lazy_image import ImageBudget, splice_images
+from pdf_generator import DOC_LAYOUT, PdfGenerator, section_template
+from pdf_optimizer import optimize_pdf, print_report
+
+# what every car gets in the catalog, the cover and export guide are only added once
+CAR_SECTIONS = ('gallery', 'details', 'financial')
+
+
+class CarStream(ActionFlowable):
+    """
+    Placeholder in the story for the remaining cars, each car's flowables are only created when the layout
+    reaches it and are dropped once drawn
+    """
+
+    def __init__(self, cars):
+        super().__init__()
+        self.cars = iter(cars)
+
+
+class CatalogGenerator(PdfGenerator):
+    """
+    One PDF with many cars built on PdfGenerator's templates. Fonts, logos and the cover background are embedded
+    once and referenced from every page.
+
+    cars is an iterable of (api_data, img_root_path) pairs, it may be a generator (e.g. an inventory query).
+    Gallery photos are lazy by default, reportlab would otherwise hold every car's photos until the catalog is
+    saved.
+    """
+
+    def __init__(self, cars, input_data, filename='catalog.pdf', car_sections=CAR_SECTIONS, fast_web_view=False,
+                 contact_sheet=False, lazy_images=True, image_budget=None, **kwargs):
+        if fast_web_view:
+            kwargs.setdefault('pageCompression', 1)
+
+        BaseDocTemplate.__init__(self, filename, **DOC_LAYOUT, **kwargs)
+
+        self.api_data = None
+        self.input_data = input_data
+        self.img_root_path = 'images'
+        self.contact_sheet = contact_sheet
+        self.lazy_images = lazy_images
+        self.image_budget = image_budget or ImageBudget()
+        self.car_sections = car_sections
+        self.car_count = 0
+        print(self.filename)
+        pdfmetrics.registerFont(TTFont('calibri', 'Calibri.ttf'))
+
+        self.add_templates()
+
+        story = [CarStream(cars), NextPageTemplate([section_template('export_guide')]), PageBreak()]
+        story.extend(self.section_story('export_guide'))
+
+        self.build(story)
+
+        if self.lazy_images:
+            splice_images(self.filename)
+
+        if fast_web_view:
+            self.optimize_report = optimize_pdf(self.filename)
+            print_report(self.filename, self.optimize_report)
+
+    def handle_flowable(self, flowables):
+        if not isinstance(flowables[0], CarStream):
+            return super().handle_flowable(flowables)
+
+        stream = flowables[0]
+        try:
+            car = next(stream.cars)
+        except StopIteration:
+            del flowables[0]
+            return
+
+        # the previous car's last page is still open, its onPageEnd (the specifications) must draw that car. Build
+        # this car's flowables with its data, then hand it over only once that page is broken.
+        current = self.api_data, self.img_root_path
+        self.api_data, self.img_root_path = car
+        self.car_count += 1
+        car_story = []
+        for idx, section in enumerate(self.car_sections):
+            car_story.extend([NextPageTemplate([section_template(section)]), PageBreak()])
+            if idx == 0:
+                car_story.append(ActionFlowable(('car', *car)))
+            car_story.extend(self.section_story(section))
+        self.api_data, self.img_root_path = current
+
+        # the stream stays behind this car's flowables to expand the next one
+        flowables[0:0] = car_story
+
+    def handle_car(self, api_data, img_root_path):
+        self.api_data, self.img_root_path = api_data, img_root_path
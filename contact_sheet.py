@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image
+
+from helper import list2table
+
+# reportlab's default table cell padding, the contact sheet reproduces the gallery table around it
+CELL_PADDING = 6
+
+
+def sheet_layout(paths, width, box, row_height):
+    """
+    [(path, x, y, w, h)] in points from the top left of the sheet, where images_table would place each photo:
+    fitted to box, left column left aligned, right column right aligned, vertically centred in its row
+    """
+    placements = []
+    for row, pair in enumerate(list2table(paths)):
+        for col, path in enumerate(pair):
+            if not path:
+                continue
+            with Image.open(path) as image:
+                scale = min(box[0] / image.width, box[1] / image.height, 1.0)
+                w, h = image.width * scale, image.height * scale
+
+            x = CELL_PADDING if col == 0 else width - CELL_PADDING - w
+            y = row * row_height + (row_height - h) / 2
+            placements.append((path, x, y, w, h))
+
+    return placements
+
+
+def compose_sheet(placements, size, output, dpi=200, quality=85):
+    """
+    Paste the placed photos onto one white RGB raster of size (points) at dpi and save it as a JPEG
+    """
+    scale = dpi / 72
+    sheet = Image.new('RGB', (round(size[0] * scale), round(size[1] * scale)), 'white')
+    for path, x, y, w, h in placements:
+        target = (max(1, round(w * scale)), max(1, round(h * scale)))
+        with Image.open(path) as image:
+            image.draft('RGB', target)
+            photo = image.convert('RGB').resize(target, Image.LANCZOS)
+        sheet.paste(photo, (round(x * scale), round(y * scale)))
+
+    tmp = f'{output}.{os.getpid()}.tmp'
+    sheet.save(tmp, 'JPEG', quality=quality, optimize=True)
+    os.replace(tmp, output)
+    return output
+
+
+def _compose(args):
+    return compose_sheet(*args)
+
+
+def sheet_key(paths, width, box, row_height, dpi, quality):
+    digest = hashlib.sha1(repr((width, box, row_height, dpi, quality)).encode())
+    for path in paths:
+        stat = os.stat(path)
+        digest.update(f'{path}:{stat.st_size}:{stat.st_mtime_ns}'.encode())
+    return digest.hexdigest()[:16]
+
+
+def contact_sheets(paths, width, box, row_height, rows_per_page, cache_dir, dpi=200, quality=85, executor=None):
+    """
+    One composited JPEG per gallery page, returns [(sheet path, (width, height) in points)]. Sheets are built on a
+    process pool and reused while the photos don't change.
+    """
+    per_page = rows_per_page * 2
+    pages = [paths[i:i + per_page] for i in range(0, len(paths), per_page)]
+    os.makedirs(cache_dir, exist_ok=True)
+
+    sheets, tasks = [], []
+    for page in pages:
+        size = (width, -(-len(page) // 2) * row_height)
+        output = os.path.join(cache_dir, f'sheet-{sheet_key(page, width, box, row_height, dpi, quality)}.jpg')
+        sheets.append((output, size))
+        if not os.path.exists(output):
+            tasks.append((sheet_layout(page, width, box, row_height), size, output, dpi, quality))
+
+    if len(tasks) > 1:
+        if executor is None:
+            with ProcessPoolExecutor(min(len(tasks), os.cpu_count() or 1)) as pool:
+                list(pool.map(_compose, tasks))
+        else:
+            list(executor.map(_compose, tasks))
+    elif tasks:
+        _compose(tasks[0])
+
+    return sheets
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+import os
+import shutil
+import socket
+import time
+
+from helper import domain_detector
+from image_fetch import fetch_image
+from image_validation import InvalidImage
+from inventory import Inventory
+from rate_limiter import RateLimiter, rate_key
+from run import crawl_in_subprocess, format_image, render_quote
+
+# image quality profiles, box and JPEG quality handed to format_image
+QUALITY_PROFILES = {
+    'high': ((800, 600), 90),
+    'low': ((400, 300), 70),
+}
+
+# seconds kept back for the PdfGenerator build
+RENDER_RESERVE = 2.0
+
+
+class Deadline:
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.started = time.monotonic()
+
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def remaining(self):
+        return self.seconds - self.elapsed()
+
+    def fraction_left(self):
+        return max(0.0, self.remaining() / self.seconds)
+
+
+def scrape_or_cached(input_data, deadline, inventory, degraded, scrape_budget=0.6):
+    """
+    Scrape the listing within scrape_budget of the time left, falling back to the inventory copy when the crawl is
+    too slow or there isn't enough time to start one
+    """
+    cached = inventory.latest_by_link(input_data['ad_link'])
+    timeout = deadline.remaining() * scrape_budget - RENDER_RESERVE
+    if cached is not None and timeout < 5:
+        degraded.append('cached_data')
+        return cached
+
+    job = dict(input_data, job_id='deadline', spider_name=domain_detector(input_data['ad_link']))
+    try:
+        car_data = crawl_in_subprocess([job], timeout=max(timeout, 1)).get('deadline')
+    except (TimeoutError, RuntimeError):
+        # too slow, or the crawl died: either way the inventory copy will do
+        car_data = None
+
+    if car_data is None:
+        if cached is None:
+            raise TimeoutError(f"no data for {input_data['ad_link']} within the deadline")
+        degraded.append('cached_data')
+        return cached
+
+    inventory.add(car_data, ad_link=input_data['ad_link'])
+    return inventory.latest(car_data['car_id'])
+
+
+def download_within(images, deadline, degraded, root_path='images/'):
+    """
+    download_image with a budget: switches to the low quality profile once half the time is gone and stops adding
+    gallery images when only the render reserve is left
+    """
+    if os.path.exists(root_path):
+        shutil.rmtree(root_path)
+    os.mkdir(root_path)
+
+    profile = 'high'
+    downloaded = 0
+    previous_timeout = socket.getdefaulttimeout()
+    limiter = RateLimiter()
+    try:
+        for idx, img in enumerate(images):
+            if deadline.remaining() <= RENDER_RESERVE:
+                break
+            if profile == 'high' and deadline.fraction_left() < 0.5:
+                profile = 'low'
+                degraded.append('low_quality_images')
+
+            wait = limiter.reserve(rate_key(img))
+            if wait >= deadline.remaining() - RENDER_RESERVE:
+                break
+            time.sleep(wait)
+
+            socket.setdefaulttimeout(max(1.0, deadline.remaining() - RENDER_RESERVE))
+            try:
+                path, _, _ = fetch_image(img, root_path + f"img-{idx}" + '.jpg', limiter)
+            except OSError:
+                continue
+
+            box, quality = QUALITY_PROFILES[profile]
+            try:
+                format_image(path, box, quality)
+            except InvalidImage:
+                os.remove(path)
+                continue
+            downloaded += 1
+    finally:
+        socket.setdefaulttimeout(previous_timeout)
+        limiter.close()
+
+    if downloaded < len(images):
+        degraded.append(f'gallery_images:{downloaded}/{len(images)}')
+    return downloaded
+
+
+def render_with_deadline(input_data, seconds, inventory_path='api/inventory.db'):
+    """
+    Produce the quote within seconds, trading rescrape freshness, gallery size and image quality for time.
+    Returns the job result with the list of what was degraded.
+    """
+    deadline = Deadline(seconds)
+    degraded = []
+
+    with Inventory(inventory_path) as inventory:
+        car_data = scrape_or_cached(input_data, deadline, inventory, degraded)
+
+    images = download_within(car_data['car_images'], deadline, degraded)
+    # archived and counted like every other quote
+    filename = render_quote(car_data, input_data, download=False)
+
+    return {
+        'car_id': car_data['car_id'],
+        'pdf': filename,
+        'images': images,
+        'elapsed': round(deadline.elapsed(), 3),
+        'met_deadline': deadline.remaining() >= 0,
+        'degraded': degraded,
+    }
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Local check of the render farm: a coordinator and several worker processes on this box, each with its own image
+cache and work directory. Listings are made up from the photos in a local folder, so nothing is scraped or
+downloaded. Renders two rounds of the same cars and checks that every requote went back to the node holding its
+photos.
+
+    python farm_check.py [--workers 3] [--cars 6] [--photos images] [--root farm_check_run]
+"""
+import argparse
+import multiprocessing
+import os
+import shutil
+import threading
+
+from render_farm import Coordinator, ImageCache, render_car, run_worker
+
+
+def copy_photos(photos):
+    def download(images, root_path):
+        os.makedirs(root_path)
+        for idx, name in enumerate(images):
+            shutil.copy(os.path.join(photos, name), os.path.join(root_path, f'img-{idx}.jpg'))
+
+    return download
+
+
+def local_job(photos):
+    names = sorted(name for name in os.listdir(photos) if name.endswith('.jpg'))
+
+    def handler(job, cache, out_dir):
+        car_id = job['ad_link'].rsplit('/', 1)[-1]
+        car_data = {'car_id': car_id, 'car_price': '25000', 'car_images': names, 'car_features': ['Tempomat'],
+                    'car_specifications': [['Kilometerstand', '12.500 km']]}
+        return render_car(job, car_data, cache, out_dir, copy_photos(photos))
+
+    return handler
+
+
+def worker(port, node, photos, root):
+    run_worker(port=port, node=node, handler=local_job(photos), cache_root=os.path.join(root, 'cache', node),
+               work_dir=os.path.join(root, 'work', node))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the render farm locally and check cache affinity')
+    parser.add_argument('--workers', type=int, default=3)
+    parser.add_argument('--cars', type=int, default=6)
+    parser.add_argument('--photos', default='images')
+    parser.add_argument('--root', default='farm_check_run')
+    args = parser.parse_args()
+
+    if os.path.exists(args.root):
+        shutil.rmtree(args.root)
+
+    def jobs(round_num):
+        return [{'job_id': f'r{round_num}-{idx}', 'ad_link': f'https://suchen.mobile.de/check/{1000000 + idx}'}
+                for idx in range(args.cars)]
+
+    with Coordinator(('127.0.0.1', 0), out_dir=os.path.join(args.root, 'quotes')) as coordinator:
+        threading.Thread(target=coordinator.serve_forever, daemon=True).start()
+        port = coordinator.server_address[1]
+        processes = [multiprocessing.Process(target=worker, args=(port, f'node-{idx}', args.photos, args.root))
+                     for idx in range(args.workers)]
+        for process in processes:
+            process.start()
+
+        coordinator.submit(jobs(1))
+        first = {result['car_id']: result['node'] for result in coordinator.wait()}
+        coordinator.submit(jobs(2))
+        coordinator.close_queue()
+        results = coordinator.wait()
+        for process in processes:
+            process.join()
+        coordinator.shutdown()
+
+    failed = [result for result in results if not result.get('ok')]
+    moved = [result for result in results[args.cars:] if result.get('ok') and first[result['car_id']] != result['node']]
+    caches = {node: ImageCache(os.path.join(args.root, 'cache', node)).car_ids() for node in set(first.values())}
+
+    print(f"round 1: {', '.join(f'{car_id}@{node}' for car_id, node in sorted(first.items()))}")
+    print(f'nodes used: {len(caches)}, cached per node: {caches}')
+    print(f'{len(failed)} failed, {len(moved)} of {args.cars} requotes rendered away from their cache')
+    if failed or moved:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
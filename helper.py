@@ -1,7 +1,16 @@
 #!/usr/bin/env python3
+import codecs
 import os
 import re
 import sys
+from datetime import datetime
+
+IMG_INDEX_RE = re.compile(r'[\.,-]?(\d+)')
+NUMBER_RE = re.compile(r'\d+(?:\.\d+)?')
+
+
+# encoding error handler turning every non ascii character into a space, the ascii runs stay in C
+codecs.register_error('non_ascii_to_space', lambda error: (' ' * (error.end - error.start), error.end))
 
 
 def image_output(images_index):
@@ -10,14 +19,14 @@ def image_output(images_index):
         return [i for i in range(int(st), int(end) + 1)]
 
     else:
-        return re.findall('[\.,-]?(\d+)', images_index)
+        return IMG_INDEX_RE.findall(images_index)
 
 
 def domain_detector(ad_link):
-    if re.search('.*?(mobile\.de)/', ad_link):
+    if 'mobile.de/' in ad_link:
         return 'SuchenMobileDe'
 
-    elif re.search('.*?(autoscout24\.de)/', ad_link):
+    elif 'autoscout24.de/' in ad_link:
         return 'AutoScout24De'
 
 
@@ -37,18 +46,20 @@ def price_format(price):
 
 
 def remove_white_spaces(input_string):
-    return re.sub(r'\s+', ' ', input_string).strip()
+    return ' '.join(input_string.split())
 
 
 def remove_unicode_char(input_string):
     """
     This function takes string as an input, and return strings after removing unicode character
     """
-    return (''.join([i if ord(i) < 128 else ' ' for i in input_string])).strip()
+    if input_string.isascii():
+        return input_string.strip()
+    return input_string.encode('ascii', 'non_ascii_to_space').decode('ascii').strip()
 
 
 def extract_number_only(input_string):
-    numbers = re.findall(r'\d+(?:\.\d+)?', input_string)
+    numbers = NUMBER_RE.findall(input_string)
     if numbers:
         return numbers
     else:
@@ -68,6 +79,31 @@ def calculate_percentage(percent, num):
     return round(float(percent) / 100 * float(num), 5)
 
 
+def financial_totals(api_data, input_data):
+    """
+    The figures of the financial offer: the fee lines, subtotal, company fees and grand total
+    """
+    totals = {
+        'car_net_price': api_data.get('car_price', 0),
+        'shipping_fees': input_data.get('shipping_fees', 0),
+        'customs': input_data.get('customs', 0),
+        'logistics_fees': input_data.get('logistics_fees', 0),
+        'company_percent': input_data.get('company_fees', 7),
+    }
+    totals['subtotal'] = sum([float(totals['car_net_price']), float(totals['shipping_fees']),
+                              float(totals['customs']), float(totals['logistics_fees'])])
+    totals['company_fees'] = calculate_percentage(totals['company_percent'], totals['subtotal'])
+    totals['total'] = totals['subtotal'] + totals['company_fees']
+    return totals
+
+
+def quote_date(input_data):
+    """
+    The date printed on a quote, today unless the job sets one
+    """
+    return input_data.get('date', datetime.today().strftime('%d.%m.%Y'))
+
+
 def list2table(list_data):
     out_put = []
     if len(list_data) % 2 == 0:
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+import os
+import struct
+from dataclasses import dataclass
+
+from PIL import Image
+
+# largest photo we decode at all, a 24 MP camera original is ~6000x4000; PIL refuses twice this outright
+MAX_PIXELS = 40_000_000
+Image.MAX_IMAGE_PIXELS = MAX_PIXELS
+
+# PNG colour type -> PIL mode
+PNG_MODES = {0: 'L', 2: 'RGB', 3: 'P', 4: 'LA', 6: 'RGBA'}
+JPEG_MODES = {1: 'L', 3: 'RGB', 4: 'CMYK'}
+
+# JPEG start-of-frame markers, every SOFn except DHT (C4), JPG (C8) and DAC (CC)
+SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+class InvalidImage(ValueError):
+    pass
+
+
+@dataclass(slots=True)
+class ImageHeader:
+    format: str
+    width: int
+    height: int
+    mode: str
+    has_alpha: bool = False
+
+    @property
+    def pixels(self):
+        return self.width * self.height
+
+
+def _read(stream, size):
+    data = stream.read(size)
+    if len(data) < size:
+        raise InvalidImage('truncated header')
+    return data
+
+
+def _jpeg_header(stream):
+    """
+    Walk the JPEG markers up to the first SOFn, reading only segment headers
+    """
+    stream.seek(2)
+    while True:
+        marker = stream.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            raise InvalidImage('truncated JPEG header')
+        # fill bytes
+        while marker[1] == 0xFF:
+            marker = marker[1:] + _read(stream, 1)
+        kind = marker[1]
+        if kind in (0xD8, 0x01) or 0xD0 <= kind <= 0xD7:
+            continue
+        if kind in (0xD9, 0xDA):
+            raise InvalidImage('JPEG without a frame header')
+
+        length = struct.unpack('>H', _read(stream, 2))[0]
+        if kind in SOF_MARKERS:
+            _, height, width, components = struct.unpack('>BHHB', _read(stream, 6))
+            if components not in JPEG_MODES:
+                raise InvalidImage(f'JPEG with {components} colour components')
+            return ImageHeader('JPEG', width, height, JPEG_MODES[components])
+        stream.seek(length - 2, os.SEEK_CUR)
+
+
+def _png_header(data, stream):
+    if len(data) < 26:
+        raise InvalidImage('truncated header')
+    if data[12:16] != b'IHDR':
+        raise InvalidImage('PNG without IHDR')
+    width, height, _, colour_type = struct.unpack('>IIBB', data[16:26])
+    mode = PNG_MODES.get(colour_type)
+    if mode is None:
+        raise InvalidImage(f'PNG colour type {colour_type}')
+
+    has_alpha = mode in ('LA', 'RGBA')
+    if not has_alpha:
+        # a tRNS chunk before the image data makes any colour type transparent
+        stream.seek(8)
+        while True:
+            chunk = stream.read(8)
+            if len(chunk) < 8:
+                break
+            length, kind = struct.unpack('>I4s', chunk)
+            if kind == b'tRNS':
+                has_alpha = True
+                break
+            if kind == b'IDAT':
+                break
+            stream.seek(length + 4, os.SEEK_CUR)
+    return ImageHeader('PNG', width, height, mode, has_alpha)
+
+
+def sniff(path):
+    """
+    Format, size and colour mode of an image file from its header only, raises InvalidImage for files that are
+    not an image
+    """
+    if os.path.getsize(path) == 0:
+        raise InvalidImage('empty file')
+
+    with open(path, 'rb') as stream:
+        data = stream.read(64)
+        if data[:2] == b'\xff\xd8':
+            return _jpeg_header(stream)
+        if data[:8] == b'\x89PNG\r\n\x1a\n':
+            return _png_header(data, stream)
+        if data.lstrip()[:1] == b'<':
+            raise InvalidImage('HTML/XML document instead of an image')
+
+    # other formats (WebP, GIF...) through PIL, which also reads no further than the header here
+    try:
+        with Image.open(path) as image:
+            return ImageHeader(image.format, image.width, image.height, image.mode,
+                               'A' in image.getbands() or 'transparency' in image.info)
+    except (OSError, Image.DecompressionBombError) as error:
+        raise InvalidImage(str(error)) from error
+
+
+def validate(path, box=(800, 600), max_pixels=MAX_PIXELS):
+    """
+    ('keep' | 'convert', header) for an image file: 'keep' when the bytes can be embedded as they are (an RGB or
+    grayscale JPEG that fits box), 'convert' when it has to go through fit_jpeg first (too big, CMYK, alpha,
+    palette or not a JPEG). Raises InvalidImage for anything not worth decoding.
+    """
+    header = sniff(path)
+    if not header.width or not header.height:
+        raise InvalidImage('image without dimensions')
+    if header.pixels > max_pixels:
+        raise InvalidImage(f'{header.width}x{header.height} is over the {max_pixels} pixel limit')
+
+    if (header.format == 'JPEG' and header.mode in ('RGB', 'L') and header.width <= box[0] and
+            header.height <= box[1]):
+        return 'keep', header
+    return 'convert', header
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+import os
+import sqlite3
+import time
+
+from car_record import CarRecord
+from helper import domain_detector
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cars (
+    id INTEGER PRIMARY KEY,
+    car_id TEXT NOT NULL,
+    marketplace TEXT,
+    ad_link TEXT,
+    car_price REAL,
+    scraped_at REAL NOT NULL,
+    record BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS cars_car_id ON cars (car_id, scraped_at);
+CREATE INDEX IF NOT EXISTS cars_marketplace ON cars (marketplace, scraped_at);
+CREATE INDEX IF NOT EXISTS cars_price ON cars (car_price);
+CREATE INDEX IF NOT EXISTS cars_scraped_at ON cars (scraped_at);
+CREATE INDEX IF NOT EXISTS cars_ad_link ON cars (ad_link, scraped_at);
+"""
+
+
+class Inventory:
+    """
+    SQLite store keeping every scrape of every car, the record itself is stored as CarRecord.dumps()
+    """
+
+    def __init__(self, path='api/inventory.db'):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add(self, car, ad_link=None, scraped_at=None):
+        if not isinstance(car, CarRecord):
+            car = CarRecord.from_dict(car)
+
+        marketplace = domain_detector(ad_link) if ad_link else None
+        with self.conn:
+            self.conn.execute(
+                'INSERT INTO cars (car_id, marketplace, ad_link, car_price, scraped_at, record) VALUES (?, ?, ?, ?, ?, ?)',
+                (car.car_id, marketplace, ad_link, float(car.car_price), scraped_at or time.time(), car.dumps()))
+
+    def add_many(self, cars, scraped_at=None):
+        """
+        cars is an iterable of (car, ad_link) pairs, inserted in one transaction
+        """
+        scraped_at = scraped_at or time.time()
+        rows = []
+        for car, ad_link in cars:
+            if not isinstance(car, CarRecord):
+                car = CarRecord.from_dict(car)
+            rows.append((car.car_id, domain_detector(ad_link) if ad_link else None, ad_link, float(car.car_price),
+                         scraped_at, car.dumps()))
+
+        with self.conn:
+            self.conn.executemany(
+                'INSERT INTO cars (car_id, marketplace, ad_link, car_price, scraped_at, record) VALUES (?, ?, ?, ?, ?, ?)',
+                rows)
+
+    def latest(self, car_id):
+        row = self.conn.execute('SELECT record FROM cars WHERE car_id = ? ORDER BY scraped_at DESC LIMIT 1',
+                                (car_id,)).fetchone()
+        return CarRecord.loads(row[0]) if row else None
+
+    def latest_by_link(self, ad_link):
+        row = self.conn.execute('SELECT record FROM cars WHERE ad_link = ? ORDER BY scraped_at DESC LIMIT 1',
+                                (ad_link,)).fetchone()
+        return CarRecord.loads(row[0]) if row else None
+
+    def history(self, car_id):
+        """
+        Every scrape of a car, oldest first, as (scraped_at, CarRecord)
+        """
+        rows = self.conn.execute('SELECT scraped_at, record FROM cars WHERE car_id = ? ORDER BY scraped_at',
+                                 (car_id,))
+        return [(scraped_at, CarRecord.loads(record)) for scraped_at, record in rows]
+
+    def diff(self, car_id):
+        """
+        Fields that changed between the last two scrapes of a car, {field: (old, new)}
+        """
+        rows = self.conn.execute('SELECT record FROM cars WHERE car_id = ? ORDER BY scraped_at DESC LIMIT 2',
+                                 (car_id,)).fetchall()
+        if len(rows) < 2:
+            return {}
+
+        new, old = (CarRecord.loads(row[0]).to_dict() for row in rows)
+        return {key: (old[key], new[key]) for key in new if key != 'job_id' and old[key] != new[key]}
+
+    def query(self, marketplace=None, min_price=None, max_price=None, since=None):
+        """
+        Latest record of every car matching the filters
+        """
+        where, params = [], []
+        if marketplace:
+            where.append('marketplace = ?')
+            params.append(marketplace)
+        if min_price is not None:
+            where.append('car_price >= ?')
+            params.append(min_price)
+        if max_price is not None:
+            where.append('car_price <= ?')
+            params.append(max_price)
+        if since is not None:
+            where.append('scraped_at >= ?')
+            params.append(since)
+
+        sql = 'SELECT record FROM cars c WHERE scraped_at = (SELECT MAX(scraped_at) FROM cars WHERE car_id = c.car_id)'
+        if where:
+            sql += ' AND ' + ' AND '.join(where)
+
+        return [CarRecord.loads(record) for record, in self.conn.execute(sql, params)]
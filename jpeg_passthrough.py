@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+import os
+
+from PIL import Image
+
+from helper import resource_path
+
+# PIL modes a PDF DCT image can be shown in without conversion
+PASSTHROUGH_MODES = ('RGB', 'L')
+
+
+def can_passthrough(img, box=(800, 600)):
+    """
+    True when img is a JPEG that already fits in box and is RGB or grayscale, only the header is read
+    """
+    try:
+        with Image.open(img) as image:
+            return (image.format == 'JPEG' and image.mode in PASSTHROUGH_MODES and
+                    image.width <= box[0] and image.height <= box[1])
+    except OSError:
+        return False
+
+
+def fit_jpeg(img, output, box=(800, 600), quality=90):
+    """
+    Downscale img to fit in box and save it as a JPEG. JPEG sources are decoded at a reduced DCT scale
+    (Image.draft) so large originals never get fully decoded.
+    """
+    with Image.open(img) as image:
+        image.draft('RGB', box)
+        if image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info:
+            # transparent areas go white like the page, not black
+            image = Image.alpha_composite(Image.new('RGBA', image.size, 'white'), image.convert('RGBA'))
+        if image.mode not in PASSTHROUGH_MODES:
+            image = image.convert('RGB')
+        image.thumbnail(box, Image.LANCZOS)
+        image.save(output, 'JPEG', quality=quality, optimize=True)
+
+    return output
+
+
+def fitted_resource(relative_path, box, cache_dir='.cache'):
+    """
+    resource_path() of an asset, swapped for a copy that fits box when the asset is larger (the cover and footer
+    logos are several thousand pixels wide but drawn a few centimetres wide)
+    """
+    path = resource_path(relative_path)
+    if can_passthrough(path, box):
+        return path
+
+    name, _ = os.path.splitext(os.path.basename(relative_path))
+    output = os.path.join(cache_dir, f'{name}-{box[0]}x{box[1]}.jpg')
+    if not os.path.exists(output) or os.path.getmtime(output) < os.path.getmtime(path):
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp = f'{output}.{os.getpid()}.tmp'
+        fit_jpeg(path, tmp, box)
+        os.replace(tmp, output)
+
+    return output
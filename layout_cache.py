@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+from collections import OrderedDict
+from functools import lru_cache
+
+from reportlab.pdfbase import pdfmetrics
+from reportlab.platypus import Paragraph, paragraph, tables
+
+
+class LRUCache:
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        try:
+            value = self.data[key]
+        except KeyError:
+            self.misses += 1
+            return None
+
+        self.data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self.data[key] = value
+        if len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+    def info(self):
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.data),
+                'hit_rate': round(self.hits / total, 3) if total else 0.0}
+
+
+PARAGRAPH_CACHE = LRUCache(maxsize=20000)
+
+
+@lru_cache(maxsize=100000)
+def string_width(text, fontName, fontSize, encoding='utf8'):
+    return pdfmetrics.stringWidth(text, fontName, fontSize, encoding)
+
+
+def install():
+    """
+    Route reportlab's paragraph and table string measuring through the process wide cache
+    """
+    paragraph.stringWidth = string_width
+    tables.stringWidth = string_width
+
+
+def style_key(style):
+    return repr(sorted((k, v) for k, v in style.__dict__.items() if k not in ('name', 'parent')))
+
+
+class CachedParagraph(Paragraph):
+    """
+    Paragraph whose line breaking is shared by every paragraph with the same text, style and width in the process
+    """
+
+    def __init__(self, text, style=None, bulletText=None, frags=None, **kwargs):
+        super().__init__(text, style, bulletText=bulletText, frags=frags, **kwargs)
+        # pieces made by split() come with ready frags and no text of their own
+        self._cacheable = frags is None and text is not None
+
+    def breakLines(self, width):
+        if not self._cacheable:
+            return super().breakLines(width)
+
+        key = (self.text, repr(self.bulletText), style_key(self.style),
+               tuple(width) if isinstance(width, (list, tuple)) else width)
+        blPara = PARAGRAPH_CACHE.get(key)
+        if blPara is None:
+            blPara = super().breakLines(width)
+            PARAGRAPH_CACHE.put(key, blPara)
+        return blPara
+
+
+def cache_info():
+    widths = string_width.cache_info()
+    total = widths.hits + widths.misses
+    return {
+        'paragraphs': PARAGRAPH_CACHE.info(),
+        'string_width': {'hits': widths.hits, 'misses': widths.misses, 'size': widths.currsize,
+                         'hit_rate': round(widths.hits / total, 3) if total else 0.0},
+    }
+
+
+def combine_cache_info(infos):
+    """
+    One cache_info() out of those of several processes
+    """
+    combined = {}
+    for info in infos:
+        for name, stats in info.items():
+            total = combined.setdefault(name, {'hits': 0, 'misses': 0, 'size': 0})
+            for key in total:
+                total[key] += stats[key]
+    for total in combined.values():
+        lookups = total['hits'] + total['misses']
+        total['hit_rate'] = round(total['hits'] / lookups, 3) if lookups else 0.0
+    return combined
+
+
+def print_cache_info(info=None):
+    for name, info in (cache_info() if info is None else info).items():
+        print(f"{name}: {info['hit_rate']:.1%} hits ({info['hits']}/{info['hits'] + info['misses']}), "
+              f"{info['size']} entries")
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+import os
+import re
+import threading
+from contextlib import contextmanager
+
+from reportlab.pdfgen.canvas import _digester
+from reportlab.platypus import Flowable
+
+from image_validation import sniff
+
+MB = 1024 * 1024
+
+CHANNELS = {'L': 1, 'LA': 2, 'P': 1, 'RGB': 3, 'RGBA': 4, 'CMYK': 4}
+
+# stands in for a JPEG stream until the built PDF is spliced, the path travels hex encoded in the token
+PLACEHOLDER_RE = re.compile(rb'%LAZYIMG\(([0-9a-f]+)\)')
+LENGTH_RE = re.compile(rb'/Length (\d+)')
+COPY_CHUNK = 1024 * 1024
+
+
+def placeholder(path):
+    return b'%LAZYIMG(' + os.fsencode(path).hex().encode() + b')'
+
+
+class ImageBudget:
+    """
+    Caps how many photos are open at once and how many bytes of them are resident while being embedded. One
+    budget per document, or one shared by documents building on several threads. A photo bigger than the whole
+    budget still goes through on its own.
+    """
+
+    def __init__(self, max_open=4, max_bytes=64 * MB):
+        self.max_open = max_open
+        self.max_bytes = max_bytes
+        self.open = 0
+        self.resident = 0
+        self.peak_open = 0
+        self.peak_bytes = 0
+        self.condition = threading.Condition()
+
+    @contextmanager
+    def hold(self, cost):
+        with self.condition:
+            self.condition.wait_for(lambda: self.open == 0 or (self.open < self.max_open and
+                                                               self.resident + cost <= self.max_bytes))
+            self.open += 1
+            self.resident += cost
+            self.peak_open = max(self.peak_open, self.open)
+            self.peak_bytes = max(self.peak_bytes, self.resident)
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.open -= 1
+                self.resident -= cost
+                self.condition.notify_all()
+
+
+class LazyImage(Flowable):
+    """
+    A photo sized from its header alone, its file is opened only when its page is drawn and let go right after.
+    Scaled down to fit box like Image._restrictSize.
+    """
+
+    def __init__(self, path, box, budget=None, hAlign='CENTER'):
+        super().__init__()
+        self.path = path
+        self.budget = budget or ImageBudget()
+        self.hAlign = hAlign
+
+        header = sniff(path)
+        factor = min(1.0, box[0] / header.width, box[1] / header.height)
+        self.drawWidth, self.drawHeight = header.width * factor, header.height * factor
+
+        # a JPEG is embedded as it is, only its bytes are read and they can be spliced in after the build
+        self.deferrable = header.format == 'JPEG' and header.mode in ('RGB', 'L')
+        if self.deferrable:
+            self.cost = os.path.getsize(path)
+        else:
+            self.cost = header.pixels * CHANNELS.get(header.mode, 4)
+
+    def wrap(self, availWidth, availHeight):
+        return self.drawWidth, self.drawHeight
+
+    def draw(self):
+        with self.budget.hold(self.cost):
+            self.canv.drawImage(self.path, 0, 0, self.drawWidth, self.drawHeight, mask='auto')
+
+        if self.deferrable:
+            # reportlab would keep the JPEG bytes until save(), keep a token instead and splice the file in after
+            doc = self.canv._doc
+            image = doc.idToObject[doc.getXObjectName(_digester(f'{self.path}auto'.encode()))]
+            image.streamContent = placeholder(self.path)
+
+
+def splice_images(path):
+    """
+    Replace the placeholder streams LazyImage left in a built PDF with their JPEG files, copied in chunks, and
+    shift the cross-reference table to match. Returns the number of images spliced.
+    """
+    with open(path, 'rb') as pdf:
+        data = pdf.read()
+
+    edits = []
+    for match in PLACEHOLDER_RE.finditer(data):
+        image_path = os.fsdecode(bytes.fromhex(match.group(1).decode()))
+        size = os.path.getsize(image_path)
+        length = None
+        for length in LENGTH_RE.finditer(data, data.rfind(b' obj', 0, match.start()), match.start()):
+            pass
+        if length is None:
+            raise ValueError(f'no /Length for the placeholder of {image_path}')
+        edits.append((length.start(1), length.end(1), str(size).encode()))
+        edits.append((match.start(), match.end(), image_path))
+
+    if not edits:
+        return 0
+
+    def shifted(offset):
+        return offset + sum((os.path.getsize(new) if isinstance(new, str) else len(new)) - (end - start)
+                            for start, end, new in edits if end <= offset)
+
+    # classic xref table and startxref, as reportlab writes them
+    startxref = data.rindex(b'startxref')
+    xref = int(data[startxref + 9:].split()[0])
+    trailer = data.index(b'trailer', xref)
+    lines = data[xref:trailer].split(b'\n')
+    table = [lines[0]]
+    for line in lines[1:]:
+        fields = line.split()
+        if len(fields) == 3 and fields[2] == b'n':
+            line = b'%010d %s n ' % (shifted(int(fields[0])), fields[1])
+        table.append(line)
+    edits.append((xref, trailer, b'\n'.join(table)))
+    edits.append((startxref, data.index(b'%%EOF', startxref), b'startxref\n%d\n' % shifted(xref)))
+    edits.sort(key=lambda edit: edit[0])
+
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as out:
+        position = 0
+        for start, end, new in edits:
+            out.write(data[position:start])
+            if isinstance(new, str):
+                with open(new, 'rb') as image:
+                    while chunk := image.read(COPY_CHUNK):
+                        out.write(chunk)
+            else:
+                out.write(new)
+            position = end
+        out.write(data[position:])
+    os.replace(tmp, path)
+
+    return sum(isinstance(new, str) for _, _, new in edits)
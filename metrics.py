@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+In-process metrics in the Prometheus text format, served over HTTP and/or written to a file every few seconds:
+
+    metrics.serve(port=9108)                       # GET http://127.0.0.1:9108/metrics
+    metrics.write_periodically('api/metrics.prom')  # node_exporter textfile collector
+
+Worker processes report what they counted with changes(snapshot()) and the exporting process merge()s it.
+"""
+import bisect
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SECONDS_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+BYTES_BUCKETS = (100e3, 250e3, 500e3, 1e6, 2.5e6, 5e6, 10e6, 25e6)
+
+
+def _label_text(labels):
+    if not labels:
+        return ''
+    pairs = ','.join('{}="{}"'.format(key, str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+                     for key, value in labels)
+    return '{' + pairs + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help_text, registry=None):
+        self.name = name
+        self.help_text = help_text
+        self.lock = threading.Lock()
+        self.values = {}
+        (REGISTRY if registry is None else registry).append(self)
+
+    def samples(self):
+        with self.lock:
+            return [(self.name, labels, value) for labels, value in self.values.items()]
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} {self.kind}']
+        lines += [f'{name}{_label_text(labels)} {_number(value)}' for name, labels, value in self.samples()]
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def __init__(self, name, help_text, registry=None):
+        super().__init__(name, help_text, registry)
+        self.functions = {}
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[tuple(sorted(labels.items()))] = value
+
+    def remove(self, **labels):
+        with self.lock:
+            self.values.pop(tuple(sorted(labels.items())), None)
+
+    def set_function(self, function, **labels):
+        """
+        Read the value from function() each time the metrics are rendered
+        """
+        self.functions[tuple(sorted(labels.items()))] = function
+
+    def samples(self):
+        for key, function in list(self.functions.items()):
+            self.set(function(), **dict(key))
+        return super().samples()
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, buckets=SECONDS_BUCKETS, registry=None):
+        super().__init__(name, help_text, registry)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            counts, total = self.values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.values[key] = (counts, total + value)
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            items = [(labels, list(counts), total) for labels, (counts, total) in self.values.items()]
+
+        for labels, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                samples.append((f'{self.name}_bucket', labels + (('le', _number(bound)),), cumulative))
+            samples.append((f'{self.name}_sum', labels, total))
+            samples.append((f'{self.name}_count', labels, cumulative))
+        return samples
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+
+
+REGISTRY = []
+
+STAGE_SECONDS = Histogram('quote_stage_seconds', 'Time spent per quote stage (scrape, download, render)')
+QUOTES = Counter('quotes_rendered_total', 'Quotes rendered')
+PDF_BYTES = Histogram('quote_pdf_bytes', 'Size of the rendered quote PDFs', buckets=BYTES_BUCKETS)
+QUEUE_DEPTH = Gauge('quote_queue_depth', 'Jobs waiting to be rendered')
+IMAGES = Counter('quote_images_total', 'Listing photos by source: downloaded or served from a local cache')
+IMAGE_BYTES = Counter('quote_image_download_bytes_total', 'Bytes of listing photos downloaded')
+SCRAPE_FAILURES = Counter('scrape_failures_total', 'Listings that could not be scraped, per marketplace')
+WORKER_RSS = Gauge('worker_rss_bytes', 'Resident memory of the render processes')
+
+
+def snapshot(registry=None):
+    """
+    Current values of the counters and histograms, to diff against with changes()
+    """
+    values = {}
+    for metric in (REGISTRY if registry is None else registry):
+        if isinstance(metric, (Counter, Histogram)):
+            with metric.lock:
+                values[metric.name] = {labels: (list(value[0]), value[1]) if isinstance(metric, Histogram) else value
+                                       for labels, value in metric.values.items()}
+    return values
+
+
+def changes(before, registry=None):
+    """
+    What the counters and histograms gained since snapshot() returned before, as JSON friendly
+    [name, labels, value] entries that merge() applies in another process
+    """
+    entries = []
+    for name, values in snapshot(registry).items():
+        old = before.get(name, {})
+        for labels, value in values.items():
+            if isinstance(value, tuple):
+                counts, total = old.get(labels, ([0] * len(value[0]), 0.0))
+                delta = [[new - count for new, count in zip(value[0], counts)], value[1] - total]
+                if any(delta[0]):
+                    entries.append([name, dict(labels), delta])
+            elif value != old.get(labels, 0):
+                entries.append([name, dict(labels), value - old.get(labels, 0)])
+    return entries
+
+
+def merge(entries, registry=None):
+    """
+    Add the changes() of a worker or background process to the metrics of this one
+    """
+    metrics = {metric.name: metric for metric in (REGISTRY if registry is None else registry)}
+    for name, labels, value in entries:
+        metric = metrics.get(name)
+        key = tuple(sorted(labels.items()))
+        if isinstance(metric, Counter):
+            metric.inc(value, **labels)
+        elif isinstance(metric, Histogram):
+            with metric.lock:
+                counts, total = metric.values.get(key, ([0] * (len(metric.buckets) + 1), 0.0))
+                metric.values[key] = ([count + delta for count, delta in zip(counts, value[0])], total + value[1])
+
+
+def render(registry=None):
+    return '\n'.join(metric.render() for metric in (REGISTRY if registry is None else registry)) + '\n'
+
+
+def write(path='api/metrics.prom', registry=None):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'w') as output:
+        output.write(render(registry))
+    os.replace(tmp, path)
+
+
+def write_periodically(path='api/metrics.prom', interval=15, registry=None):
+    def loop():
+        while True:
+            write(path, registry)
+            time.sleep(interval)
+
+    thread = threading.Thread(target=loop, daemon=True)
+    thread.start()
+    return thread
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(port=9108, host='127.0.0.1'):
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+from pypdf import PdfWriter
+
+from pdf_generator import PdfGenerator, SECTIONS
+
+
+def render_section(api_data, input_data, section, filename):
+    PdfGenerator(api_data=api_data, input_data=input_data, sections=(section,), filename=filename)
+    return filename
+
+
+def merge_sections(paths, output):
+    """
+    Concatenate the section PDFs and keep a single copy of the objects they share (footer logo, fonts)
+    """
+    writer = PdfWriter()
+    for path in paths:
+        writer.append(path)
+
+    writer.compress_identical_objects(remove_identicals=True, remove_orphans=True)
+    with open(output, 'wb') as pdf:
+        writer.write(pdf)
+
+    return output
+
+
+def render_parallel(api_data, input_data, output=None, executor=None, sections=SECTIONS):
+    """
+    Lay out each section of the quote in its own worker process and merge them into one PDF. The footer carries
+    no page number, so every section can be built without knowing how many pages come before it.
+    Pass a long-lived ProcessPoolExecutor to skip the worker start up on every quote.
+    """
+    output = output or f"{api_data['car_id']}.pdf"
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers=min(len(sections), os.cpu_count() or 1))
+
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            futures = [executor.submit(render_section, api_data, input_data, section,
+                                       os.path.join(tmp_dir, f'{idx}-{section}.pdf'))
+                       for idx, section in enumerate(sections)]
+            return merge_sections([future.result() for future in futures], output)
+    finally:
+        if own_executor:
+            executor.shutdown()
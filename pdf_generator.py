@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 import os
-from datetime import datetime
 
+from reportlab import rl_config
 from reportlab.lib import colors
 from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_JUSTIFY
 from reportlab.lib.pagesizes import A4
@@ -11,24 +11,117 @@ from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
 
 from reportlab.platypus import BaseDocTemplate, Frame, Image, PageTemplate, NextPageTemplate, Table, \
-    TableStyle, Paragraph, Spacer, PageBreak
+    TableStyle, Paragraph, Spacer, PageBreak, Flowable
 
-from helper import list2table, calculate_percentage, price_format, resource_path
+from helper import list2table, financial_totals, price_format, quote_date, resource_path
+from contact_sheet import contact_sheets
+from jpeg_passthrough import fitted_resource
+from lazy_image import ImageBudget, LazyImage, splice_images
+from layout_cache import CachedParagraph, install as install_layout_cache
+from pdf_optimizer import optimize_pdf, print_report
+
+install_layout_cache()
+
+# embed JPEG bytes as raw DCTDecode streams instead of wrapping them in ASCII85 (+25% size)
+rl_config.useA85 = 0
+
+# gallery cell, 4:3 like the scraped photos, letterboxed in the table cell
+GALLERY_BOX = (230, 172.5)
+
+DOC_LAYOUT = dict(page_size=A4, leftMargin=1.5 * cm, rightMargin=1.5 * cm, bottomMargin=0.75 * cm, _pageBreakQuick=0)
+
+# the independent parts of a quote in document order, and the page template each one starts on
+SECTIONS = ('cover', 'gallery', 'details', 'financial', 'export_guide')
+SECTION_TEMPLATES = ['FirstPage', 'ImagesPages', 'car_details_pg', 'LaterPages']
+
+# form XObjects holding everything a fee or date change touches, replaced in place by quote_update
+FOOTER_FORM = 'quoteFooter'
+
+
+def financial_form(api_data):
+    return f"quoteFinancial.{api_data['car_id']}"
+
+
+def section_template(section):
+    return {'cover': 'FirstPage', 'gallery': 'ImagesPages', 'details': 'car_details_pg'}.get(section, 'LaterPages')
+
+
+class FormFlowable(Flowable):
+    """
+    Draws its flowables stacked into a named form XObject, once per document
+    """
+
+    def __init__(self, name, flowables):
+        super().__init__()
+        self.name = name
+        self.flowables = flowables
+
+    def wrap(self, availWidth, availHeight):
+        self.sizes = [flowable.wrap(availWidth, availHeight) for flowable in self.flowables]
+        self.width = max(w for w, h in self.sizes)
+        self.height = sum(h for w, h in self.sizes)
+        return self.width, self.height
+
+    def draw(self):
+        if not self.canv.hasForm(self.name):
+            self.canv.beginForm(self.name, -2, -2, self.width + 2, self.height + 2)
+            y = self.height
+            for flowable, (w, h) in zip(self.flowables, self.sizes):
+                y -= h
+                flowable.drawOn(self.canv, 0, y)
+            self.canv.endForm()
+
+        self.canv.doForm(self.name)
 
 
 class PdfGenerator(BaseDocTemplate):
-    def __init__(self, api_data, input_data, **kwargs):
-        super().__init__(f"{api_data['car_id']}.pdf", page_size=A4, leftMargin=1.5 * cm, rightMargin=1.5 * cm,
-                         bottomMargin=0.75 * cm,
-                         _pageBreakQuick=0, **kwargs)
+    # composite each gallery page into one raster instead of placing every photo on its own
+    contact_sheet = False
+    # open gallery photos only while their page is drawn, within image_budget
+    lazy_images = False
+
+    def __init__(self, api_data, input_data, fast_web_view=False, sections=SECTIONS, filename=None,
+                 img_root_path='images', contact_sheet=False, lazy_images=False, image_budget=None, **kwargs):
+        if fast_web_view:
+            kwargs.setdefault('pageCompression', 1)
+
+        super().__init__(filename or f"{api_data['car_id']}.pdf", **DOC_LAYOUT, **kwargs)
 
         self.api_data = api_data
         self.input_data = input_data
-        self.img_root_path = 'images'
-        print(f"{api_data['car_id']}.pdf")
+        self.img_root_path = img_root_path
+        self.contact_sheet = contact_sheet
+        self.lazy_images = lazy_images
+        self.image_budget = image_budget or ImageBudget()
+        print(self.filename)
         self.styles = getSampleStyleSheet()
         pdfmetrics.registerFont(TTFont('calibri', 'Calibri.ttf'))
 
+        self.add_templates()
+
+        # add pdf contents, section by section
+        story = []
+        for idx, section in enumerate(sections):
+            if idx == 0:
+                self._firstPageTemplateIndex = SECTION_TEMPLATES.index(section_template(section))
+            else:
+                story.extend([NextPageTemplate([section_template(section)]), PageBreak()])
+            story.extend(self.section_story(section))
+
+        if sections[-1] == 'cover':
+            # nothing flows onto the cover, end its page explicitly
+            story.append(PageBreak())
+
+        self.build(story)
+
+        if self.lazy_images:
+            splice_images(self.filename)
+
+        if fast_web_view:
+            self.optimize_report = optimize_pdf(self.filename)
+            print_report(self.filename, self.optimize_report)
+
+    def add_templates(self):
         # Setting up the frames
         cover_pg_frame = Frame(0, 0, self.width + self.leftMargin * 2, 0,
                                id='cover_pg_frame', showBoundary=0)
@@ -57,37 +150,44 @@ class PdfGenerator(BaseDocTemplate):
 
         self.addPageTemplates([first_page, images_pages, car_details_pg, later_pages])
 
-        # add pdf contents
-        story = [NextPageTemplate(['ImagesPages']), PageBreak(), self.images_table()]
+    def section_story(self, section):
+        if section == 'cover':
+            # the cover is drawn by the FirstPage template callbacks
+            return []
 
-        story.extend([NextPageTemplate(['car_details_pg']), PageBreak(), self.car_features])
+        if section == 'gallery':
+            if self.contact_sheet:
+                return self.contact_sheet_pages()
+            return [self.images_table()]
 
-        story.extend([NextPageTemplate("LaterPages"), PageBreak()])
+        if section == 'details':
+            return [self.car_features]
 
-        style = ParagraphStyle(name="CustomStyle", fontSize=16, alignment=TA_LEFT)
+        if section == 'financial':
+            style = ParagraphStyle(name="CustomStyle", fontSize=16, alignment=TA_LEFT)
+            table1, table2 = self.financial_pg()
 
-        story.extend([Spacer(0, 35), Paragraph("Financial Offer:", style), Spacer(0, 25), self.financial_pg()[0],
-                      self.financial_pg()[1],
-                      Spacer(0, 100),
-                      Paragraph("Payment terms:", style),
-                      Spacer(0, 6),
-                      ])
+            story = [Spacer(0, 35), Paragraph("Financial Offer:", style), Spacer(0, 25),
+                     FormFlowable(financial_form(self.api_data), [table1, table2]),
+                     Spacer(0, 100),
+                     Paragraph("Payment terms:", style),
+                     Spacer(0, 6),
+                     ]
 
-        for i in range(4):
-            story.extend([Paragraph(f"{i + 1}-", style), Spacer(0, 6)])
-        story.append(PageBreak())
+            for i in range(4):
+                story.extend([Paragraph(f"{i + 1}-", style), Spacer(0, 6)])
+            return story
 
-        export_guide = Paragraph("EXPORT GUIDE", ParagraphStyle(name="CustomStyle", fontSize=22, alignment=TA_CENTER,
-                                                                fontName='Helvetica'))
+        if section == 'export_guide':
+            export_guide = Paragraph("EXPORT GUIDE", ParagraphStyle(name="CustomStyle", fontSize=22,
+                                                                    alignment=TA_CENTER, fontName='Helvetica'))
 
-        thank_you = Paragraph("THANK YOU", ParagraphStyle(name="CustomStyle", fontSize=18, alignment=TA_CENTER,
-                                                          fontName='Helvetica'))
+            thank_you = Paragraph("THANK YOU", ParagraphStyle(name="CustomStyle", fontSize=18, alignment=TA_CENTER,
+                                                              fontName='Helvetica'))
 
-        story.extend([export_guide, Spacer(0, 80)])
-        story.extend(self.export_guide_pg())
-        story.extend([Spacer(0, 70), thank_you])
+            return [export_guide, Spacer(0, 80), *self.export_guide_pg(), Spacer(0, 70), thank_you]
 
-        self.build(story)
+        raise ValueError(f'unknown section {section!r}')
 
     def header(self, canvas, doc):
         # Helvetica, Courier, Times Roman)
@@ -109,15 +209,16 @@ class PdfGenerator(BaseDocTemplate):
         canvas.restoreState()
 
     def footer(self, canvas, doc):
-        logo = resource_path('footer_logo.jpg')
+        logo = fitted_resource('footer_logo.jpg', (250, 250))
         footer_logo = Image(logo)
         footer_logo._restrictSize(60, 60)
 
-        date = self.input_data.get('date', datetime.today().strftime('%d.%m.%Y'))
+        date = quote_date(self.input_data)
         quotation_num = self.input_data.get('quotation_num', 'XX')
 
-        table_data = [(footer_logo, f'Quotation No. {quotation_num}'),
-                      ('TEST', f"Date: {date}")]
+        # quotation number and date live in a form XObject of their own, see quote_update
+        table_data = [(footer_logo, ''),
+                      ('TEST', '')]
 
         table_style = [
             # ('GRID', (0, 0), (-1, -1), 1, colors.gray),
@@ -130,9 +231,21 @@ class PdfGenerator(BaseDocTemplate):
 
         header_content = Table(data=table_data, style=table_style, colWidths=(doc.width / 2 + 155, 100), rowHeights=15)
 
+        if not canvas.hasForm(FOOTER_FORM):
+            fields = Table(data=[[f'Quotation No. {quotation_num}'], [f"Date: {date}"]], colWidths=100, rowHeights=15,
+                           style=[('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
+                                  ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+                                  ('FONTSIZE', (0, 0), (-1, -1), 8)])
+            fields.wrap(100, 30)
+            canvas.beginForm(FOOTER_FORM, -2, -2, 200, 32)
+            fields.drawOn(canvas, 0, 0)
+            canvas.endForm()
+
         canvas.saveState()
         w, h = header_content.wrap(doc.width, doc.bottomMargin)
         header_content.drawOn(canvas, doc.leftMargin, doc.bottomMargin)
+        canvas.translate(doc.leftMargin + doc.width / 2 + 155, doc.bottomMargin)
+        canvas.doForm(FOOTER_FORM)
         canvas.restoreState()
 
     def header_and_footer(self, canvas, doc):
@@ -148,8 +261,8 @@ class PdfGenerator(BaseDocTemplate):
 
         canvas.saveState()
 
-        canvas.drawImage(resource_path("cover_pg_logo.jpg"), doc.width / 2 - doc.leftMargin, doc.height - 160, 180, 180,
-                         preserveAspectRatio=True)
+        canvas.drawImage(fitted_resource("cover_pg_logo.jpg", (750, 750)), doc.width / 2 - doc.leftMargin,
+                         doc.height - 160, 180, 180, preserveAspectRatio=True)
 
         canvas.drawImage(resource_path("cover_pg_background.jpg"), image_x, PAGE_HEIGHT / 4, 500, 500,
                          preserveAspectRatio=True)
@@ -226,7 +339,8 @@ class PdfGenerator(BaseDocTemplate):
     def car_features(self):
         bullet_style = ParagraphStyle(name="CustomStyle", leftIndent=13, leading=12, fontName="Helvetica", fontSize=12,
                                       bulletFontSize=14)
-        x = [Paragraph(f'<bullet>&bull;</bullet> {item}', bullet_style) for item in self.api_data['car_features']]
+        x = [CachedParagraph(f'<bullet>&bull;</bullet> {item}', bullet_style)
+             for item in self.api_data['car_features']]
         table_data = list2table(x)
 
         table_style = TableStyle([
@@ -243,24 +357,49 @@ class PdfGenerator(BaseDocTemplate):
 
     def images_table(self):
         table_grid = self.create_images()
-        image_table = Table(table_grid, colWidths=self.width / 2,
+        image_table = Table(table_grid, colWidths=self.width / 2, rowHeights=GALLERY_BOX[1] + 6,
                             style=TableStyle([
                                 # ('GRID', (0, 0), (-1, -1), 0.5, colors.lightgrey),
 
                                 ('ALIGN', (0, 0), (0, -1), 'LEFT'),
                                 ('ALIGN', (1, 0), (1, -1), 'RIGHT'),
+                                ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
                             ]))
         return image_table
 
+    def gallery_images(self):
+        return [f'{self.img_root_path}/{i}' for i in os.listdir(self.img_root_path) if
+                'main' not in i and i.endswith('.jpg')]
+
+    def contact_sheet_pages(self, dpi=200):
+        """
+        The gallery as one pre-laid-out JPEG per page, drawn where images_table would have put each photo
+        """
+        row_height = GALLERY_BOX[1] + 6
+        # the frame's own 6pt padding on top and bottom
+        rows_per_page = int((self.height - 12) // row_height)
+        sheets = contact_sheets(self.gallery_images(), self.width, GALLERY_BOX, row_height, rows_per_page,
+                                cache_dir=os.path.join(self.img_root_path, '.sheets'), dpi=dpi)
+
+        story = []
+        for path, (width, height) in sheets:
+            if story:
+                story.append(PageBreak())
+            story.append(Image(path, width=width, height=height))
+        return story
+
     def create_images(self):
         table_images = []
 
-        image_list = [f'{self.img_root_path}/{i}' for i in os.listdir(self.img_root_path) if
-                      'main' not in i and i.endswith('.jpg')]
+        image_list = self.gallery_images()
 
         for idx, img in enumerate(image_list):
+            if self.lazy_images:
+                table_images.append(LazyImage(img, GALLERY_BOX, self.image_budget))
+                continue
+
             im = Image(img)
-            im._restrictSize(230, 230)
+            im._restrictSize(*GALLERY_BOX)
             im.hAlign = 'CENTER'
             im.vAlign = 'CENTER'
             table_images.append(im)
@@ -268,21 +407,14 @@ class PdfGenerator(BaseDocTemplate):
         return list2table(table_images)
 
     def financial_pg(self):
-        car_net_price = self.api_data.get('car_price', 0)
-        shipping_fees = self.input_data.get('shipping_fees', 0)
-        customs = self.input_data.get('customs', 0)
-        logistics_fees = self.input_data.get('logistics_fees', 0)
-
-        subtotal = sum([float(car_net_price), float(shipping_fees), float(customs), float(logistics_fees)])
-        company_fees = calculate_percentage(self.input_data.get('company_fees', 7), subtotal)
-        total = subtotal + company_fees
+        totals = financial_totals(self.api_data, self.input_data)
 
         table_data = [
             ['S.NO.', 'DETAILS', 'TOTAL PRICE €'],
-            ['1.', 'Car Net Price', f"€{price_format(car_net_price)}"],
-            ['2.', 'Shipping Fees', f'€{price_format(shipping_fees)}'],
-            ['3.', 'Customs', f'€{price_format(customs)}'],
-            ['4.', 'Clearance and shipping to Cairo', f'€{price_format(logistics_fees)}'],
+            ['1.', 'Car Net Price', f"€{price_format(totals['car_net_price'])}"],
+            ['2.', 'Shipping Fees', f"€{price_format(totals['shipping_fees'])}"],
+            ['3.', 'Customs', f"€{price_format(totals['customs'])}"],
+            ['4.', 'Clearance and shipping to Cairo', f"€{price_format(totals['logistics_fees'])}"],
         ]
 
         table1_style = TableStyle([
@@ -308,9 +440,9 @@ class PdfGenerator(BaseDocTemplate):
         table1 = Table(table_data, style=table1_style, colWidths=(35, 238, 238), rowHeights=26)
 
         table2_data = [
-            ['', 'Subtotal', f'€{price_format(subtotal)}'],
-            ['', f'G&O fees (%{self.input_data.get("company_fees", 7)})', f'€{price_format(company_fees)}'],
-            ['', 'Grand Total', f'€{price_format(total)}']
+            ['', 'Subtotal', f"€{price_format(totals['subtotal'])}"],
+            ['', f"G&O fees (%{totals['company_percent']})", f"€{price_format(totals['company_fees'])}"],
+            ['', 'Grand Total', f"€{price_format(totals['total'])}"]
         ]
 
         table2_style = TableStyle([
@@ -341,7 +473,7 @@ class PdfGenerator(BaseDocTemplate):
                                        spaceBefore=12,
                                        bulletFontSize=20)
 
-        heading = [Paragraph(f'<bullet>&bull;</bullet> <b>{item}</b>', heading_style) for item in heading]
+        heading = [CachedParagraph(f'<bullet>&bull;</bullet> <b>{item}</b>', heading_style) for item in heading]
 
         paragraph = [
             """Select your desired car from reputable marketplaces such as <u><a href="https://www.mobile.de/" color="blue">Mobile.de</a></u> or <u><a href="https://www.autoscout24.de/" color="blue">AutoScout24.de</a></u>, and our team of specialists will assist you in the selection process, ensuring that you make an informed decision.""",
@@ -353,10 +485,10 @@ class PdfGenerator(BaseDocTemplate):
         paragraph_style = ParagraphStyle(name="CustomStyle", fontName="calibri", fontSize=10, leading=14,
                                          leftIndent=19, alignment=TA_JUSTIFY)
 
-        paragraph = [Paragraph(f'{item}', paragraph_style) for item in paragraph]
+        paragraph = [CachedParagraph(f'{item}', paragraph_style) for item in paragraph]
 
         closing = """Thank you for considering our car export services. We are confident that we can meet your requirements and deliver a seamless experience. Should you have any questions or need further clarification, please do not hesitate to contact our dedicated customer support team. We look forward to the opportunity of working with you and ensuring a successful car export.<br/><br/>Sincerely,"""
-        closing = Paragraph(closing,
+        closing = CachedParagraph(closing,
                             ParagraphStyle(name="CustomStyle", fontSize=10, leftIndent=19,
                                            alignment=TA_JUSTIFY))
 
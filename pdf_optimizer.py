@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+import base64
+import glob
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+
+try:
+    import pikepdf
+except ImportError:
+    pikepdf = None
+
+LINEARIZED_RE = re.compile(rb'/Linearized\b.*?/E\s+(\d+)', re.S)
+
+# a slow mobile link, bytes per second
+SLOW_LINK_BPS = 1_000_000 / 8
+
+
+def first_page_bytes(path):
+    """
+    Bytes a viewer has to receive before it can show page one: the /E offset of a linearized file,
+    the whole file otherwise (the cross-reference table sits at the end)
+    """
+    with open(path, 'rb') as pdf:
+        head = pdf.read(1024)
+
+    match = LINEARIZED_RE.search(head)
+    if match:
+        return int(match.group(1))
+    return os.path.getsize(path)
+
+
+def pdf_stats(path, link_bps=SLOW_LINK_BPS):
+    first_page = first_page_bytes(path)
+    return {
+        'size': os.path.getsize(path),
+        'first_page_bytes': first_page,
+        'first_page_seconds': round(first_page / link_bps, 2),
+    }
+
+
+def strip_ascii85_images(pdf):
+    """
+    Unwrap ASCII85 encoded DCT images (older reportlab output) back to their raw JPEG bytes. qpdf leaves them alone
+    because it can't decode DCT losslessly.
+    """
+    for obj in pdf.objects:
+        if not isinstance(obj, pikepdf.Stream) or obj.get('/Subtype') != '/Image':
+            continue
+
+        filters = obj.get('/Filter')
+        if isinstance(filters, pikepdf.Array) and [str(f) for f in filters] == ['/ASCII85Decode', '/DCTDecode']:
+            data = obj.read_raw_bytes().strip()
+            if data.endswith(b'~>'):
+                data = data[:-2]
+            obj.write(base64.a85decode(data), filter=pikepdf.Name.DCTDecode)
+
+
+def optimize_pdf(path, output=None, link_bps=SLOW_LINK_BPS):
+    """
+    Rewrite a PDF linearized ("fast web view"), with object and cross-reference streams and every Flate stream
+    recompressed at level 9. ASCII85 wrapped streams from reportlab are unwrapped, DCT images are kept as they are.
+    Returns the before/after stats.
+    """
+    output = output or path
+    before = pdf_stats(path, link_bps)
+
+    fd, tmp = tempfile.mkstemp(suffix='.pdf', dir=os.path.dirname(os.path.abspath(output)))
+    os.close(fd)
+    try:
+        if pikepdf is not None:
+            pikepdf.settings.set_flate_compression_level(9)
+            with pikepdf.open(path) as pdf:
+                strip_ascii85_images(pdf)
+                pdf.save(tmp, linearize=True, object_stream_mode=pikepdf.ObjectStreamMode.generate,
+                         compress_streams=True, recompress_flate=True,
+                         stream_decode_level=pikepdf.StreamDecodeLevel.generalized)
+        elif shutil.which('qpdf'):
+            subprocess.run(['qpdf', '--linearize', '--object-streams=generate', '--compress-streams=y',
+                            '--recompress-flate', '--compression-level=9', '--decode-level=generalized', path, tmp],
+                           check=True)
+        else:
+            raise RuntimeError('pikepdf or the qpdf command is needed to linearize PDFs')
+
+        os.replace(tmp, output)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+    after = pdf_stats(output, link_bps)
+    return {'before': before, 'after': after}
+
+
+def print_report(name, report):
+    before, after = report['before'], report['after']
+    print(f"{name}: {before['size'] / 1e6:.2f} MB -> {after['size'] / 1e6:.2f} MB, "
+          f"first page after {before['first_page_seconds']}s -> {after['first_page_seconds']}s")
+
+
+def main(paths):
+    """
+    Report what fast web view output would save on existing quotes, the originals are left untouched
+    """
+    with tempfile.TemporaryDirectory() as out_dir:
+        for path in paths:
+            report = optimize_pdf(path, output=os.path.join(out_dir, os.path.basename(path)))
+            print_report(os.path.basename(path), report)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:] or sorted(glob.glob('*.pdf')))
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+import base64
+import html
+import io
+import os
+
+from PIL import Image, ImageDraw
+
+from helper import financial_totals, price_format
+from image_fetch import variant_url
+
+THUMBNAIL_BOX = (240, 180)
+
+FEE_LINES = (('Car Net Price', 'car_net_price'), ('Shipping Fees', 'shipping_fees'), ('Customs', 'customs'),
+             ('Clearance and shipping to Cairo', 'logistics_fees'))
+
+
+def local_images(img_root_path):
+    if not img_root_path or not os.path.isdir(img_root_path):
+        return []
+    return sorted((os.path.join(img_root_path, name) for name in os.listdir(img_root_path)
+                   if name.startswith('img-') and name.endswith('.jpg')),
+                  key=lambda path: int(os.path.basename(path)[4:-4]))
+
+
+def thumbnail(path, box=THUMBNAIL_BOX):
+    with Image.open(path) as image:
+        image.draft('RGB', box)
+        image = image.convert('RGB')
+        image.thumbnail(box)
+    return image
+
+
+def data_uri(image):
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=70)
+    return 'data:image/jpeg;base64,' + base64.b64encode(buffer.getvalue()).decode()
+
+
+def fee_rows(totals):
+    rows = [(label, totals[key]) for label, key in FEE_LINES]
+    rows += [('Subtotal', totals['subtotal']), (f"G&O fees (%{totals['company_percent']})", totals['company_fees']),
+             ('Grand Total', totals['total'])]
+    return [(label, f'€{price_format(value)}') for label, value in rows]
+
+
+def preview_html(api_data, input_data, img_root_path='images'):
+    """
+    Single page HTML summary of a quote: financial offer, specifications and photo thumbnails. Downloaded photos
+    are inlined as small thumbnails, otherwise the page points at the marketplace CDN's small variants.
+    """
+    paths = local_images(img_root_path)
+    if paths:
+        sources = [data_uri(thumbnail(path)) for path in paths]
+    else:
+        sources = [variant_url(url) for url in api_data['car_images']]
+
+    esc = html.escape
+    fees = ''.join(f'<tr><td>{esc(label)}</td><td class="num">{esc(value)}</td></tr>'
+                   for label, value in fee_rows(financial_totals(api_data, input_data)))
+    specs = ''.join(f'<tr><td>{esc(str(name))}</td><td>{esc(str(value))}</td></tr>'
+                    for name, value in api_data['car_specifications'])
+    photos = ''.join(f'<img src="{esc(src)}" width="{THUMBNAIL_BOX[0]}">' for src in sources)
+    parties = ', '.join(esc(str(input_data[key])) for key in ('purchaser_name', 'quotation_num', 'date')
+                        if input_data.get(key))
+
+    return f"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Quote preview {esc(str(api_data['car_id']))}</title>
+<style>
+body {{ font-family: Helvetica, Arial, sans-serif; margin: 24px; }}
+table {{ border-collapse: collapse; margin-bottom: 16px; }}
+td {{ border: 1px solid #ccc; padding: 4px 10px; }}
+td.num {{ text-align: right; }}
+tr:last-child td {{ font-weight: bold; background: #eee; }}
+img {{ margin: 4px; }}
+</style></head>
+<body>
+<h2>Car {esc(str(api_data['car_id']))}</h2>
+<p>{parties}</p>
+<h3>Financial Offer</h3>
+<table>{fees}</table>
+<h3>Specifications</h3>
+<table>{specs}</table>
+<h3>Photos ({len(sources)})</h3>
+<div>{photos}</div>
+</body></html>
+"""
+
+
+def preview_png(api_data, input_data, output, img_root_path='images', width=900):
+    """
+    Low resolution PNG of the same summary, thumbnails only when the photos are already downloaded
+    """
+    # PIL's built-in font has no euro sign
+    rows = [(label, value.replace('€', 'EUR ')) for label, value in fee_rows(financial_totals(api_data, input_data))]
+    rows.append(('', ''))
+    rows += [(str(name), str(value)) for name, value in api_data['car_specifications']]
+
+    line_height = 16
+    cell = (width // 4, width // 4 * 3 // 4)
+    thumbnails = [thumbnail(path, (cell[0] - 10, cell[1] - 10)) for path in local_images(img_root_path)]
+    text_height = 20 + line_height * (len(rows) + 2)
+    sheet = Image.new('RGB', (width, text_height + -(-len(thumbnails) // 4) * cell[1] + 10), 'white')
+    draw = ImageDraw.Draw(sheet)
+    draw.text((20, 20), f"Car {api_data['car_id']}", fill='black')
+    for idx, (label, value) in enumerate(rows, start=2):
+        draw.text((20, 20 + idx * line_height), label, fill='black')
+        draw.text((420 - draw.textlength(value), 20 + idx * line_height), value, fill='black')
+
+    for idx, image in enumerate(thumbnails):
+        sheet.paste(image, (5 + (idx % 4) * cell[0], text_height + (idx // 4) * cell[1]))
+
+    sheet.save(output, 'PNG')
+    return output
+
+
+def write_preview(api_data, input_data, output, img_root_path='images'):
+    """
+    Write a .html or .png preview, picked by the output extension
+    """
+    if output.endswith('.png'):
+        return preview_png(api_data, input_data, output, img_root_path)
+
+    with open(output, 'w', encoding='utf-8') as page:
+        page.write(preview_html(api_data, input_data, img_root_path))
+    return output
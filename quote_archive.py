@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import time
+import zlib
+
+from helper import quote_date
+
+STREAM_RE = re.compile(rb'stream\r?\n(.*?)(?:\r?\n)?endstream', re.S)
+
+# streams at least this big (images, fonts) become chunks of their own and are shared between quotes
+MIN_CHUNK = 4096
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS quotes (
+    id INTEGER PRIMARY KEY,
+    car_id TEXT NOT NULL,
+    quotation_num TEXT,
+    purchaser_name TEXT,
+    date TEXT,
+    archived_at REAL NOT NULL,
+    size INTEGER NOT NULL,
+    sha256 TEXT NOT NULL,
+    manifest TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS quotes_number_purchaser ON quotes (quotation_num, purchaser_name);
+CREATE INDEX IF NOT EXISTS quotes_car_id ON quotes (car_id, archived_at);
+CREATE INDEX IF NOT EXISTS quotes_date ON quotes (date);
+CREATE TABLE IF NOT EXISTS chunks (
+    sha256 TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    stored INTEGER NOT NULL
+);
+"""
+
+
+def split_pdf(data):
+    """
+    Cut a PDF around its large stream bodies, the pieces concatenated give back the exact file
+    """
+    chunks = []
+    start = 0
+    for match in STREAM_RE.finditer(data):
+        body_start, body_end = match.span(1)
+        if body_end - body_start < MIN_CHUNK:
+            continue
+        if body_start > start:
+            chunks.append(data[start:body_start])
+        chunks.append(data[body_start:body_end])
+        start = body_end
+
+    chunks.append(data[start:])
+    return [chunk for chunk in chunks if chunk]
+
+
+class QuoteArchive:
+    """
+    Every issued quotation, indexed by car_id, quotation number, purchaser and date. PDFs are stored as a manifest
+    of content addressed, compressed chunks so photos and fonts repeated across versions are kept once.
+    """
+
+    def __init__(self, root='archive'):
+        self.root = root
+        os.makedirs(os.path.join(root, 'objects'), exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(root, 'index.db'))
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _chunk_path(self, digest):
+        return os.path.join(self.root, 'objects', digest[:2], digest[2:])
+
+    def _store_chunk(self, chunk):
+        digest = hashlib.sha256(chunk).hexdigest()
+        if self.conn.execute('SELECT 1 FROM chunks WHERE sha256 = ?', (digest,)).fetchone():
+            return digest
+
+        compressed = zlib.compress(chunk, 9)
+        # already compressed data (JPEG, Flate streams) is kept as is, flagged by the first byte
+        blob = b'z' + compressed if len(compressed) < len(chunk) else b'r' + chunk
+
+        path = self._chunk_path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as out:
+            out.write(blob)
+        os.replace(tmp, path)
+
+        # another process may have stored the same chunk meanwhile, its file is identical
+        self.conn.execute('INSERT OR IGNORE INTO chunks (sha256, size, stored) VALUES (?, ?, ?)',
+                          (digest, len(chunk), len(blob)))
+        return digest
+
+    def _load_chunk(self, digest):
+        with open(self._chunk_path(digest), 'rb') as blob:
+            data = blob.read()
+        return zlib.decompress(data[1:]) if data[:1] == b'z' else data[1:]
+
+    def put(self, path, api_data, input_data):
+        """
+        Archive a generated quote, returns its archive id
+        """
+        with open(path, 'rb') as pdf:
+            data = pdf.read()
+
+        with self.conn:
+            manifest = [self._store_chunk(chunk) for chunk in split_pdf(data)]
+            cursor = self.conn.execute(
+                'INSERT INTO quotes (car_id, quotation_num, purchaser_name, date, archived_at, size, sha256, manifest) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (str(api_data['car_id']), input_data.get('quotation_num'), input_data.get('purchaser_name'),
+                 quote_date(input_data), time.time(), len(data), hashlib.sha256(data).hexdigest(),
+                 json.dumps(manifest)))
+        return cursor.lastrowid
+
+    def _restore(self, row):
+        if row is None:
+            return None
+        sha256, manifest = row
+        data = b''.join(self._load_chunk(digest) for digest in json.loads(manifest))
+        if hashlib.sha256(data).hexdigest() != sha256:
+            raise ValueError('archived quote is corrupt')
+        return data
+
+    def get(self, archive_id):
+        return self._restore(self.conn.execute('SELECT sha256, manifest FROM quotes WHERE id = ?',
+                                               (archive_id,)).fetchone())
+
+    def get_quote(self, quotation_num, purchaser_name=None):
+        """
+        PDF bytes of the latest version of quotation_num issued to purchaser_name
+        """
+        return self._restore(self.conn.execute(
+            'SELECT sha256, manifest FROM quotes WHERE quotation_num = ? AND purchaser_name IS ? '
+            'ORDER BY archived_at DESC LIMIT 1', (quotation_num, purchaser_name)).fetchone())
+
+    def find(self, car_id=None, date=None):
+        where, params = [], []
+        if car_id is not None:
+            where.append('car_id = ?')
+            params.append(str(car_id))
+        if date is not None:
+            where.append('date = ?')
+            params.append(date)
+
+        sql = 'SELECT id, car_id, quotation_num, purchaser_name, date, archived_at, size FROM quotes'
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        columns = ('id', 'car_id', 'quotation_num', 'purchaser_name', 'date', 'archived_at', 'size')
+        return [dict(zip(columns, row)) for row in self.conn.execute(sql + ' ORDER BY archived_at', params)]
+
+    def stats(self):
+        raw = self.conn.execute('SELECT COALESCE(SUM(size), 0), COUNT(*) FROM quotes').fetchone()
+        stored = self.conn.execute('SELECT COALESCE(SUM(stored), 0), COUNT(*) FROM chunks').fetchone()
+        return {'quotes': raw[1], 'raw_bytes': raw[0], 'stored_bytes': stored[0], 'chunks': stored[1],
+                'ratio': round(stored[0] / raw[0], 3) if raw[0] else 0.0}
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+import os
+import tempfile
+
+from pypdf import PdfReader, PdfWriter
+from pypdf.generic import DictionaryObject, NameObject, NumberObject
+
+from pdf_generator import FOOTER_FORM, PdfGenerator, financial_form
+from quote_archive import QuoteArchive
+
+
+def form_xobjects(pages, names):
+    """
+    {resource name: form stream} of the named reportlab forms used by pages
+    """
+    wanted = {f'/FormXob.{name}' for name in names}
+    forms = {}
+    for page in pages:
+        xobjects = page['/Resources'].get_object().get('/XObject', {})
+        for key, ref in xobjects.get_object().items():
+            if key in wanted:
+                forms[key] = ref.get_object()
+    return forms
+
+
+def append_revision(writer, reader, path):
+    """
+    Append the objects writer changed to path as an incremental update with a classic xref table, like the one
+    reportlab wrote the original with. pypdf would append an xref stream, which leaves the mixed file with an xref
+    that qpdf rejects.
+    """
+    objects = sorted(writer.list_objects_in_increment(), key=lambda ref: ref.idnum)
+    with open(path, 'r+b') as pdf:
+        data = pdf.read()
+        previous = int(data[data.rindex(b'startxref') + 9:].split()[0])
+        if not data.endswith(b'\n'):
+            pdf.write(b'\n')
+
+        offsets = []
+        for ref in objects:
+            offsets.append((ref.idnum, ref.generation, pdf.tell()))
+            pdf.write(f'{ref.idnum} {ref.generation} obj\n'.encode())
+            ref.get_object().write_to_stream(pdf)
+            pdf.write(b'\nendobj\n')
+
+        xref = pdf.tell()
+        # the head of the free list opens every xref section
+        pdf.write(b'xref\n0 1\n0000000000 65535 f \n')
+        start = 0
+        while start < len(offsets):
+            end = start + 1
+            while end < len(offsets) and offsets[end][0] == offsets[end - 1][0] + 1:
+                end += 1
+            pdf.write(f'{offsets[start][0]} {end - start}\n'.encode())
+            for _, generation, offset in offsets[start:end]:
+                pdf.write(f'{offset:010d} {generation:05d} n \n'.encode())
+            start = end
+
+        trailer = DictionaryObject({
+            NameObject('/Size'): NumberObject(max(reader.trailer['/Size'], offsets[-1][0] + 1)),
+            NameObject('/Root'): writer.root_object.indirect_reference,
+            NameObject('/Prev'): NumberObject(previous),
+        })
+        for key in ('/Info', '/ID'):
+            if key in reader.trailer:
+                trailer[NameObject(key)] = reader.trailer.raw_get(key)
+        pdf.write(b'trailer\n')
+        trailer.write_to_stream(pdf)
+        pdf.write(f'\nstartxref\n{xref}\n%%EOF\n'.encode())
+
+
+def update_quote(path, api_data, input_data):
+    """
+    Re-issue an existing quote with new fees, date or quotation number by appending an incremental revision
+    that swaps the footer and financial forms. Pages, images and fonts already in the file are reused as they are.
+    The re-issued quote is archived like a new one. Returns the number of bytes appended.
+    """
+    names = (FOOTER_FORM, financial_form(api_data))
+    size_before = os.path.getsize(path)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # the financial page alone carries both forms
+        patch_path = os.path.join(tmp_dir, 'patch.pdf')
+        PdfGenerator(api_data=api_data, input_data=input_data, sections=('financial',), filename=patch_path)
+        new_forms = form_xobjects(PdfReader(patch_path).pages, names)
+
+        reader = PdfReader(path)
+        writer = PdfWriter(reader, incremental=True)
+        replaced = set()
+        for page in writer.pages:
+            xobjects = page['/Resources'].get_object().get('/XObject')
+            if xobjects is None:
+                continue
+
+            xobjects = xobjects.get_object()
+            for key in list(xobjects):
+                if key in new_forms:
+                    xobjects[NameObject(key)] = new_forms[key].clone(writer).indirect_reference
+                    replaced.add(key)
+
+        missing = set(new_forms) - replaced
+        if missing or len(new_forms) != len(names):
+            raise ValueError(f'{path} was not generated with replaceable forms ({", ".join(names)})')
+
+        append_revision(writer, reader, path)
+
+    with QuoteArchive() as archive:
+        archive.put(path, api_data, input_data)
+    return os.path.getsize(path) - size_before
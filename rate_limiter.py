@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+import os
+import sqlite3
+import time
+from urllib.parse import urlsplit
+
+from helper import domain_detector
+
+# (requests per second, burst) per marketplace, shared by every process on the machine
+BUDGETS = {
+    'SuchenMobileDe': (2.0, 4),
+    'AutoScout24De': (2.0, 4),
+}
+DEFAULT_BUDGET = (5.0, 10)
+
+# image CDNs count against the budget of their marketplace
+IMAGE_HOSTS = {
+    'classistatic.de': 'SuchenMobileDe',
+    'autoscout24.net': 'AutoScout24De',
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS buckets (
+    key TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated REAL NOT NULL
+);
+"""
+
+
+def rate_key(url):
+    """
+    The budget a request to url is charged to: the domain_detector name of the marketplace, or the host
+    """
+    name = domain_detector(url)
+    if name:
+        return name
+
+    host = urlsplit(url).hostname or ''
+    for suffix, marketplace in IMAGE_HOSTS.items():
+        if host == suffix or host.endswith('.' + suffix):
+            return marketplace
+    return host
+
+
+class RateLimiter:
+    """
+    Token buckets kept in SQLite so every scraper and downloader process draws from the same budget. A request
+    reserves its token right away, the bucket may go negative, and the caller sleeps until its token would have
+    been refilled. That keeps each domain at its rate without processes polling each other.
+    """
+
+    def __init__(self, path='api/rate_limits.db', budgets=None, default=DEFAULT_BUDGET):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.budgets = BUDGETS if budgets is None else budgets
+        self.default = default
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def reserve(self, key, tokens=1):
+        """
+        Take tokens from the bucket of key, returns how many seconds to wait before sending the request
+        """
+        rate, burst = self.budgets.get(key, self.default)
+        now = time.time()
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = self.conn.execute('SELECT tokens, updated FROM buckets WHERE key = ?', (key,)).fetchone()
+            available = burst if row is None else min(burst, row[0] + (now - row[1]) * rate)
+            available -= tokens
+            self.conn.execute('INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)',
+                              (key, available, now))
+            self.conn.execute('COMMIT')
+        except BaseException:
+            self.conn.execute('ROLLBACK')
+            raise
+
+        return max(0.0, -available / rate)
+
+    def acquire(self, url, tokens=1):
+        """
+        Block until a request to url fits in its budget
+        """
+        wait = self.reserve(rate_key(url), tokens)
+        if wait:
+            time.sleep(wait)
+        return wait
+
+
+class RateLimitMiddleware:
+    """
+    Scrapy downloader middleware charging every request to the shared budgets. The wait happens on the reactor,
+    other requests keep flowing meanwhile.
+
+        DOWNLOADER_MIDDLEWARES = {'rate_limiter.RateLimitMiddleware': 590}
+        RATE_LIMIT_DB = 'api/rate_limits.db'
+    """
+
+    def __init__(self, path):
+        self.limiter = RateLimiter(path)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.settings.get('RATE_LIMIT_DB', 'api/rate_limits.db'))
+
+    async def process_request(self, request, spider):
+        wait = self.limiter.reserve(rate_key(request.url))
+        if wait:
+            from scrapy.utils.defer import maybe_deferred_to_future
+            from twisted.internet import reactor, task
+            # a bare Deferred can't be awaited under the asyncio reactor
+            await maybe_deferred_to_future(task.deferLater(reactor, wait, lambda: None))
+        return None
@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+"""
+Coordinator/worker render farm over a line based TCP protocol.
+
+Every message is one JSON line. A PDF travels as a result line with its byte size, followed by exactly that many
+raw bytes.
+
+    worker -> {"op": "get", "node": "host-1", "cached": ["366683071", ...]}
+    coord  -> {"op": "job", "job": {...}} | {"op": "wait", "seconds": 1} | {"op": "done"}
+    worker -> {"op": "result", "job_id": ..., "car_id": ..., "ok": true, "date": ..., "metrics": [...],
+               "size": 123456}  + 123456 bytes
+    coord  -> {"op": "ack"}
+
+    python render_farm.py coordinator jobs.json [--port 8750] [--out quotes/]
+    python render_farm.py worker [--host 127.0.0.1] [--port 8750] [--node name] [--cache-root dir] [--work-dir dir]
+"""
+import argparse
+import json
+import os
+import shutil
+import socket
+import socketserver
+import threading
+import time
+
+from helper import domain_detector, quote_date
+from metrics import IMAGES, PDF_BYTES, QUEUE_DEPTH, changes, merge, serve as serve_metrics, snapshot
+from pdf_generator import PdfGenerator
+from quote_archive import QuoteArchive
+
+DEFAULT_PORT = 8750
+
+# how long a job waits for the node that has its images cached before any idle node may take it
+AFFINITY_WAIT = 5.0
+
+
+def send_message(stream, message, payload=b''):
+    stream.write(json.dumps(message).encode() + b'\n' + payload)
+    stream.flush()
+
+
+def read_message(stream):
+    line = stream.readline()
+    if not line:
+        raise ConnectionError('connection closed')
+    return json.loads(line)
+
+
+class Coordinator(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, out_dir='quotes', affinity_wait=AFFINITY_WAIT):
+        super().__init__(address, CoordinatorHandler)
+        self.out_dir = out_dir
+        self.affinity_wait = affinity_wait
+        self.lock = threading.Condition()
+        self.pending = []
+        self.in_flight = {}
+        self.results = []
+        self.submitted = 0
+        self.closed = False
+        # ad_link -> car_id learned from results, car_id -> node holding its images
+        self.car_ids = {}
+        self.car_nodes = {}
+        os.makedirs(out_dir, exist_ok=True)
+
+    def submit(self, jobs):
+        with self.lock:
+            for idx, job in enumerate(jobs):
+                job.setdefault('job_id', f'job-{self.submitted + idx}')
+                self.pending.append((time.monotonic(), job))
+            self.submitted += len(jobs)
+            QUEUE_DEPTH.set(len(self.pending))
+            self.lock.notify_all()
+
+    def close_queue(self):
+        with self.lock:
+            self.closed = True
+            self.lock.notify_all()
+
+    def next_job(self, node, cached):
+        """
+        A job whose car is cached on node, or one no other node is better placed for, or one that has waited
+        longer than affinity_wait
+        """
+        cached = set(cached)
+        now = time.monotonic()
+        with self.lock:
+            best = None
+            for idx, (queued_at, job) in enumerate(self.pending):
+                car_id = self.car_ids.get(job['ad_link'])
+                if car_id in cached:
+                    best = idx
+                    break
+                owner = self.car_nodes.get(car_id)
+                if best is None and (owner is None or owner == node or now - queued_at > self.affinity_wait):
+                    best = idx
+
+            if best is None:
+                if not self.pending and not self.in_flight and self.closed:
+                    return 'done', None
+                return 'wait', None
+
+            _, job = self.pending.pop(best)
+            self.in_flight[job['job_id']] = job
+            QUEUE_DEPTH.set(len(self.pending))
+            return 'job', job
+
+    def requeue(self, job_id):
+        with self.lock:
+            job = self.in_flight.pop(job_id, None)
+            if job is not None:
+                self.pending.insert(0, (time.monotonic(), job))
+                QUEUE_DEPTH.set(len(self.pending))
+                self.lock.notify_all()
+
+    def finish(self, node, message, payload):
+        with self.lock:
+            job = self.in_flight.pop(message['job_id'], None)
+            if job is None:
+                return
+            if message.get('car_id'):
+                self.car_ids[job['ad_link']] = message['car_id']
+                self.car_nodes[message['car_id']] = node
+        merge(message.get('metrics', []))
+
+        path = None
+        if message.get('ok'):
+            PDF_BYTES.observe(len(payload))
+            path = os.path.join(self.out_dir, f"{message['car_id']}.pdf")
+            with open(path, 'wb') as pdf:
+                pdf.write(payload)
+            # dated by the worker, which printed the date on the quote
+            with QuoteArchive() as archive:
+                archive.put(path, {'car_id': message['car_id']}, dict(job, date=message['date']))
+
+        with self.lock:
+            self.results.append(dict(message, node=node, path=path))
+            self.lock.notify_all()
+
+    def wait(self, timeout=None):
+        """
+        Block until every submitted job has a result, returns the results
+        """
+        with self.lock:
+            self.lock.wait_for(lambda: len(self.results) >= self.submitted, timeout)
+            return list(self.results)
+
+
+class CoordinatorHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        current = None
+        try:
+            while True:
+                message = read_message(self.rfile)
+                node = message.get('node', self.client_address[0])
+
+                if message['op'] == 'get':
+                    kind, job = self.server.next_job(node, message.get('cached', []))
+                    if kind == 'job':
+                        current = job['job_id']
+                        send_message(self.wfile, {'op': 'job', 'job': job})
+                    elif kind == 'wait':
+                        send_message(self.wfile, {'op': 'wait', 'seconds': 1})
+                    else:
+                        send_message(self.wfile, {'op': 'done'})
+                        return
+
+                elif message['op'] == 'result':
+                    payload = self.rfile.read(message.get('size', 0))
+                    self.server.finish(node, message, payload)
+                    current = None
+                    send_message(self.wfile, {'op': 'ack'})
+        except (ConnectionError, OSError, ValueError):
+            pass
+        finally:
+            # a worker that disconnects mid-job gives its job back
+            if current is not None:
+                self.server.requeue(current)
+
+
+class ImageCache:
+    """
+    Formatted images per car_id on this node, reused for requotes of the same car as long as its listing still
+    shows the same photos. The photo urls are kept next to the images.
+    """
+
+    MANIFEST = 'car_images.json'
+
+    def __init__(self, root='image_cache'):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, car_id):
+        return os.path.join(self.root, str(car_id))
+
+    def car_ids(self):
+        # downloads in progress live next to the cached cars as <car_id>.<pid>.tmp
+        return [name for name in os.listdir(self.root) if os.path.isdir(self.path(name)) and
+                not name.endswith('.tmp')]
+
+    def has(self, car_id, images):
+        try:
+            with open(os.path.join(self.path(car_id), self.MANIFEST)) as manifest:
+                return json.load(manifest) == list(images)
+        except (OSError, ValueError):
+            return False
+
+    def store(self, car_id, images, image_dir):
+        """
+        Move a freshly downloaded image_dir in as the images of car_id, replacing stale ones
+        """
+        with open(os.path.join(image_dir, self.MANIFEST), 'w') as manifest:
+            json.dump(list(images), manifest)
+        path = self.path(car_id)
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.replace(image_dir, path)
+
+
+def render_job(job, cache, out_dir):
+    """
+    Scrape, download (unless cached on this node) and render one job, returns (car_id, pdf path)
+    """
+    from run import crawl_in_subprocess, download_image
+
+    job = dict(job)
+    job.setdefault('spider_name', domain_detector(job['ad_link']))
+    car_data = crawl_in_subprocess([job])[job['job_id']]
+    return render_car(job, car_data, cache, out_dir, download_image)
+
+
+def render_car(job, car_data, cache, out_dir, download):
+    """
+    Render a scraped car from the photos cached on this node, download(images=..., root_path=...) fetches them
+    first when they are missing or stale. The PDF is named after the job, two jobs for one car never share it.
+    """
+    img_root_path = cache.path(car_data['car_id'])
+    if not cache.has(car_data['car_id'], car_data['car_images']):
+        tmp = f'{img_root_path}.{os.getpid()}.tmp'
+        download(images=car_data['car_images'], root_path=tmp)
+        cache.store(car_data['car_id'], car_data['car_images'], tmp)
+    else:
+        IMAGES.inc(len(car_data['car_images']), source='cache')
+
+    filename = os.path.join(out_dir, f"{job['job_id']}.pdf")
+    PdfGenerator(api_data=car_data, input_data=job, filename=filename, img_root_path=img_root_path)
+    return car_data['car_id'], filename
+
+
+def run_worker(host='127.0.0.1', port=DEFAULT_PORT, node=None, handler=render_job, cache_root=None, work_dir=None):
+    """
+    Pull and render jobs until the coordinator is done. The image cache and work directory default to ones of
+    this node, so several workers on one box each have their own.
+    """
+    node = node or f'{socket.gethostname()}-{os.getpid()}'
+    cache = ImageCache(cache_root or os.path.join('image_cache', node))
+    work_dir = work_dir or os.path.join('farm_work', node)
+    os.makedirs(work_dir, exist_ok=True)
+
+    with socket.create_connection((host, port)) as connection:
+        stream = connection.makefile('rwb')
+        while True:
+            send_message(stream, {'op': 'get', 'node': node, 'cached': cache.car_ids()})
+            message = read_message(stream)
+            if message['op'] == 'done':
+                return
+            if message['op'] == 'wait':
+                time.sleep(message['seconds'])
+                continue
+
+            job = message['job']
+            before = snapshot()
+            try:
+                car_id, path = handler(job, cache, work_dir)
+                with open(path, 'rb') as pdf:
+                    payload = pdf.read()
+                os.remove(path)
+                result = {'op': 'result', 'node': node, 'job_id': job['job_id'], 'car_id': car_id, 'ok': True,
+                          'date': quote_date(job), 'size': len(payload)}
+            except Exception as error:
+                payload = b''
+                result = {'op': 'result', 'node': node, 'job_id': job['job_id'], 'ok': False, 'error': repr(error),
+                          'size': 0}
+
+            # what the job counted here (downloads, cache hits) is exported by the coordinator
+            result['metrics'] = changes(before)
+            send_message(stream, result, payload)
+            read_message(stream)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Render farm coordinator/worker')
+    parser.add_argument('role', choices=('coordinator', 'worker'))
+    parser.add_argument('jobs', nargs='?', help='JSON list of input_data jobs (coordinator)')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--node')
+    parser.add_argument('--out', default='quotes')
+    parser.add_argument('--cache-root', help='image cache of the worker (default image_cache/<node>)')
+    parser.add_argument('--work-dir', help='where the worker renders (default farm_work/<node>)')
+    parser.add_argument('--metrics-port', type=int, help='serve Prometheus metrics of the coordinator on this port')
+    args = parser.parse_args()
+
+    if args.role == 'worker':
+        run_worker(args.host, args.port, args.node, cache_root=args.cache_root, work_dir=args.work_dir)
+        return
+
+    with open(args.jobs) as data:
+        jobs = json.load(data)
+
+    if args.metrics_port:
+        serve_metrics(args.metrics_port, host='0.0.0.0')
+
+    with Coordinator(('0.0.0.0', args.port), out_dir=args.out) as coordinator:
+        threading.Thread(target=coordinator.serve_forever, daemon=True).start()
+        coordinator.submit(jobs)
+        coordinator.close_queue()
+        for result in coordinator.wait():
+            status = result['path'] if result.get('ok') else result.get('error')
+            print(f"{result['job_id']} on {result['node']}: {status}")
+        coordinator.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,48 @@
 #!/usr/bin/env python3
 
 import json
+import multiprocessing
+import queue
 import shutil
+import threading
+import time
 
-import wget
 from PIL import Image
+from scrapy import signals
 from scrapy.crawler import CrawlerProcess
 
+from car_record import CarRecord
 from helper import *
+from image_fetch import fetch_image
+from image_validation import InvalidImage, validate as validate_image
+from inventory import Inventory
+from layout_cache import cache_info, combine_cache_info, print_cache_info
+from metrics import IMAGE_BYTES, IMAGES, PDF_BYTES, QUEUE_DEPTH, QUOTES, SCRAPE_FAILURES, STAGE_SECONDS, WORKER_RSS, \
+    changes as metric_changes_since, merge as merge_metrics, snapshot as snapshot_metrics, write as write_metrics
+from jpeg_passthrough import fit_jpeg
 from pdf_generator import PdfGenerator
+from preview import write_preview
+from quote_archive import QuoteArchive
+from rate_limiter import RateLimiter
+from scheduler import CostModel, JobScheduler, StageTimer, job_features
+from text_normalize import normalize_item
+from worker_memory import rss_bytes, run_jobs
 from scraper.autoScout24_de import AutoScout24De
 from scraper.suchen_mobile_de import SuchenMobileDe
 
+SPIDERS = {'SuchenMobileDe': SuchenMobileDe, 'AutoScout24De': AutoScout24De}
+
+# every crawl and image download on this machine shares the per-marketplace budgets of rate_limiter
+RATE_LIMIT_MIDDLEWARES = {'rate_limiter.RateLimitMiddleware': 590}
+
+# each ad link gets a crawler of its own (the spiders take one listing each), so concurrency and autothrottle
+# settings would only ever see a single request. The lanes of calling_spider_batch set how many crawls run at
+# once and the rate limiter keeps them polite.
+BATCH_SETTINGS = {
+    "LOG_LEVEL": "INFO",
+    "DOWNLOADER_MIDDLEWARES": RATE_LIMIT_MIDDLEWARES,
+}
+
 
 def calling_spider(spider_name, url, img_idx):
     process = CrawlerProcess(
@@ -22,59 +53,163 @@ def calling_spider(spider_name, url, img_idx):
                     "overwrite": True,
                 }
             },
+            "DOWNLOADER_MIDDLEWARES": RATE_LIMIT_MIDDLEWARES,
         }
     )
     process.crawl(spider_name, url, img_idx)
     process.start()
 
 
+def calling_spider_batch(jobs, max_parallel=16, output='api/items.json'):
+    """
+    Crawl every job (input_data dict with 'job_id', 'spider_name', 'ad_link' and 'img_index') in one
+    CrawlerProcess, at most max_parallel crawls run at the same time. Returns {job_id: car_data}, jobs for a
+    marketplace without a spider are left out like failed crawls.
+    """
+    results = {}
+    pending = []
+    for job in jobs:
+        if job.get('spider_name') in SPIDERS:
+            pending.append(job)
+        else:
+            print(f"{job['job_id']}: no spider for {job['ad_link']}")
+    if not pending:
+        return results
+
+    process = CrawlerProcess(settings=BATCH_SETTINGS)
+
+    def crawl_next(_=None):
+        if not pending:
+            return
+        job = pending.pop(0)
+        crawler = process.create_crawler(SPIDERS[job['spider_name']])
+        crawler.signals.connect(tag_item(job['job_id'], results), signal=signals.item_scraped, weak=False)
+        return process.crawl(crawler, [job['ad_link']], job['img_index']).addBoth(crawl_next)
+
+    lanes = [crawl_next() for _ in range(min(max_parallel, len(pending)))]
+    # the reactor is installed with the first crawler, import it only now
+    from twisted.internet import defer, reactor
+
+    defer.DeferredList([lane for lane in lanes if lane is not None]).addBoth(lambda _: reactor.stop())
+    process.start(stop_after_crawl=False)
+
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as data:
+        json.dump([car.to_dict() for car in results.values()], data)
+
+    return results
+
+
+def _crawl(jobs, results):
+    results.put({job_id: car.to_dict() for job_id, car in calling_spider_batch(jobs).items()})
+
+
+def crawl_in_subprocess(jobs, timeout=None):
+    """
+    Run calling_spider_batch in a child process, Twisted's reactor can't be restarted within one process.
+    Raises TimeoutError when the crawl isn't done after timeout seconds and RuntimeError when the child dies
+    without a result.
+    """
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_crawl, args=(jobs, results))
+    process.start()
+    started = time.monotonic()
+    try:
+        while True:
+            try:
+                return results.get(timeout=0.5)
+            except queue.Empty:
+                pass
+            if not process.is_alive():
+                # it may have posted its result right before exiting
+                try:
+                    return results.get(timeout=0.5)
+                except queue.Empty:
+                    raise RuntimeError(f'crawl process died without a result (exit code {process.exitcode})')
+            if timeout is not None and time.monotonic() - started > timeout:
+                process.terminate()
+                raise TimeoutError(f'crawl not done after {timeout}s')
+    finally:
+        process.join()
+
+
+def tag_item(job_id, results):
+    def item_scraped(item, response, spider):
+        item['job_id'] = job_id
+        results[job_id] = CarRecord.from_dict(normalize_item(item))
+
+    return item_scraped
+
+
 def read_car_data():
     with open('api/item.json') as data:
-        return json.loads(data.read())[0]
+        return CarRecord.from_dict(normalize_item(json.loads(data.read())[0]))
 
 
-def download_image(images):
+def download_image(images, root_path='images/'):
+    """
+    Download and format the car images within the marketplace's rate budget, returns the bytes downloaded, the
+    decode time and the time spent waiting on the rate limiter for the listing
+    """
     # image_folder = resource_path('images')
 
-    if os.path.exists(f'images/'):
-        shutil.rmtree(f'images/')
-        os.mkdir(f'images')
-    else:
-        os.mkdir(f'images')
-
-    root_path = f'images/'
-
-    imgs = [wget.download(img, out=root_path + f"img-{idx}" + '.jpg') for idx, img in enumerate(images)]
-    for img in imgs:
-        format_image(img)
-
-    # return [wget.download(img, out=root_path + f"img-{idx}" + '.jpg') for idx, img in enumerate(images)]
-
-
-def format_image(img):
-    output = img
-
-    image = Image.open(img)
-    width, height = image.size
-
-    width_factor = 800 / width
-    height_factor = 600 / height
-
-    resizing_factor = min(width_factor, height_factor)
-
-    new_width = int(width * resizing_factor)
-    new_height = int(height * resizing_factor)
-
-    # Resize the image
-    resized_image = image.resize((new_width, new_height), Image.ANTIALIAS)
-
-    new_image = Image.new("RGB", (800, 600), (255, 255, 255))
-    new_image.paste(resized_image, ((800 - new_width) // 2, (600 - new_height) // 2))
-
-    new_image.save(output)
-
-
-def front_end():
+    if os.path.exists(root_path):
+        shutil.rmtree(root_path)
+    os.makedirs(root_path)
+
+    stats = {'bytes': 0, 'variants': 0, 'rejected': 0, 'decode_seconds': 0.0, 'throttled_seconds': 0.0}
+    with RateLimiter() as limiter:
+        for idx, img in enumerate(images):
+            stats['throttled_seconds'] += limiter.acquire(img)
+            output = os.path.join(root_path, f"img-{idx}.jpg")
+            try:
+                path, size, used_variant = fetch_image(img, output, limiter)
+            except OSError as error:
+                # a 404 or a dropped connection loses that photo only, like a bad image does
+                print(f'Skipping {img}: {error}')
+                if os.path.exists(output):
+                    os.remove(output)
+                stats['rejected'] += 1
+                continue
+            stats['bytes'] += size
+            stats['variants'] += used_variant
+            IMAGES.inc(source='downloaded')
+            IMAGE_BYTES.inc(size)
+
+            started = time.perf_counter()
+            try:
+                format_image(path)
+            except InvalidImage as error:
+                # one bad photo is dropped from the gallery, the rest of the quote goes on
+                print(f'Skipping {img}: {error}')
+                os.remove(path)
+                stats['rejected'] += 1
+            stats['decode_seconds'] += time.perf_counter() - started
+
+    return stats
+
+
+def format_image(img, box=(800, 600), quality=90):
+    """
+    JPEGs that already fit the box are kept byte for byte and embedded as they are, anything else is downscaled
+    once. Letterboxing is done by the gallery layout. The header is checked first, raises InvalidImage for files
+    that are not worth decoding.
+    """
+    action, _ = validate_image(img, box)
+    if action == 'keep':
+        return img
+
+    try:
+        return fit_jpeg(img, img, box, quality)
+    except (OSError, Image.DecompressionBombError) as error:
+        # a header that looked fine over a truncated or corrupt body
+        raise InvalidImage(str(error)) from error
+
+
+def front_end(on_listing=None):
+    """
+    Ask for the quote inputs, on_listing(input_data) is called as soon as the ad link and image indices are known
+    """
     input_data = {}
 
     # scraping inputs
@@ -86,6 +221,9 @@ def front_end():
     img_index_input = input('Images index (1,2,3 or 1:8): ')
     input_data['img_index'] = image_output(img_index_input)
 
+    if on_listing is not None:
+        on_listing(dict(input_data))
+
     # # pdf inputs
 
     seller_name = input("Seller name: ")
@@ -147,16 +285,233 @@ def main():
 
     # input_data['ad_link'] = "https://www.autoscout24.de/angebote/mercedes-benz-cls-63-amg-cls-63-amg-amg-speedshift-mct-edition-1-benzin-silber-7dd85c34-e8d0-49de-8189-05ab792d3c5f?ipc=recommendation&ipl=homepage-engine-itemBased&source=homepage_recommender&position=2&source_otp=t10"
 
+    car_data = scrape_listing(input_data)
+
+    render_quote(car_data, input_data)
+
+
+def scrape_listing(input_data):
+    """
+    Crawl the ad of input_data and store it in the inventory, returns car_data
+    """
     if input_data['spider_name'] == 'SuchenMobileDe':
         calling_spider(spider_name=SuchenMobileDe, url=[input_data['ad_link']], img_idx=input_data['img_index'])
     else:
         calling_spider(spider_name=AutoScout24De, url=[input_data['ad_link']], img_idx=input_data['img_index'])
 
-    car_data = read_car_data()
+    try:
+        car_data = read_car_data()
+    except (IndexError, ValueError, OSError):
+        SCRAPE_FAILURES.inc(marketplace=input_data['spider_name'])
+        raise
+
+    with Inventory() as inventory:
+        inventory.add(car_data, ad_link=input_data['ad_link'])
+    return car_data
+
 
+def prefetch_listing(input_data):
+    """
+    Scrape and download the photos of a listing ahead of rendering, the results are left in api/item.json,
+    the inventory and images/
+    """
+    car_data = scrape_listing(input_data)
     download_image(images=car_data['car_images'])
 
-    PdfGenerator(api_data=car_data, input_data=input_data)
+
+def render_quote(car_data, input_data, download=True):
+    if download:
+        with STAGE_SECONDS.time(stage='download'):
+            download_image(images=car_data['car_images'])
+
+    with STAGE_SECONDS.time(stage='render'):
+        pdf = PdfGenerator(api_data=car_data, input_data=input_data)
+    QUOTES.inc()
+    PDF_BYTES.observe(os.path.getsize(pdf.filename))
+
+    with QuoteArchive() as archive:
+        archive.put(pdf.filename, car_data, input_data)
+    return pdf.filename
+
+
+def preview_then_render(input_data, preview_path='preview.html', confirm=input):
+    """
+    Scrape, write a quick preview of the quote and render the full PDF in the background once it is confirmed.
+    Returns the rendering process, or None when the preview is rejected.
+    """
+    car_data = scrape_listing(input_data)
+
+    # the photos of a new car are not downloaded yet, the preview shows the CDN thumbnails instead
+    write_preview(car_data, input_data, preview_path, img_root_path=None)
+    print(f'Preview: {os.path.abspath(preview_path)}')
+
+    if confirm('Render the full quote? [Y/n] ').strip().lower() not in ('', 'y', 'yes'):
+        return None
+
+    counted = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_render_in_background, args=(car_data, input_data, counted))
+    process.start()
+    threading.Thread(target=_collect_metrics, args=(process, counted), daemon=True).start()
+    return process
+
+
+def _render_in_background(car_data, input_data, counted):
+    before = snapshot_metrics()
+    try:
+        render_quote(car_data, input_data)
+    finally:
+        counted.put(metric_changes_since(before))
+        counted.close()
+        counted.join_thread()
+
+
+def _collect_metrics(process, counted):
+    """
+    Fold what a background render counted into the metrics of this process once it is done
+    """
+    entries = None
+    while entries is None:
+        # checked before reading, so a result posted right before exiting is still picked up
+        alive = process.is_alive()
+        try:
+            entries = counted.get(timeout=0.5)
+        except queue.Empty:
+            if not alive:
+                # killed before it could report
+                return
+    process.join()
+    merge_metrics(entries)
+    write_metrics()
+
+
+def interactive_quote():
+    """
+    front_end() with the scrape and photo download running in the background while the remaining prompts are
+    answered, rendering starts as soon as both are done
+    """
+    prefetch = {}
+
+    def start_prefetch(listing):
+        prefetch['process'] = multiprocessing.Process(target=prefetch_listing, args=(listing,))
+        prefetch['process'].start()
+
+    input_data = front_end(on_listing=start_prefetch)
+
+    process = prefetch['process']
+    process.join()
+    if process.exitcode != 0:
+        raise RuntimeError(f"prefetching {input_data['ad_link']} failed (exit code {process.exitcode})")
+
+    return render_quote(read_car_data(), input_data, download=False)
+
+
+def rerender(car_id, input_data):
+    """
+    Regenerate the quote of an already scraped car from the inventory, without crawling again
+    """
+    with Inventory() as inventory:
+        car_data = inventory.latest(car_id)
+
+    if car_data is None:
+        raise KeyError(f'{car_id} is not in the inventory')
+
+    download_image(images=car_data['car_images'])
+    pdf = PdfGenerator(api_data=car_data, input_data=input_data)
+    with QuoteArchive() as archive:
+        archive.put(pdf.filename, car_data, input_data)
+
+
+def render_batch_job(task):
+    """
+    Download and render one main_batch job into images of its own, returns the pdf, its stage timings and what
+    was counted on the way (for batches rendered on worker processes)
+    """
+    before = snapshot_metrics()
+    img_root_path = os.path.join('images', task['job_id'])
+
+    timer = StageTimer()
+    with timer.stage('download'):
+        download_image(images=task['api_data']['car_images'], root_path=img_root_path)
+    with timer.stage('render'):
+        pdf = PdfGenerator(api_data=task['api_data'], input_data=task['input_data'], img_root_path=img_root_path)
+    shutil.rmtree(img_root_path)
+
+    return {'job_id': task['job_id'], 'filename': pdf.filename, 'stages': timer.stages,
+            'metrics': metric_changes_since(before), 'layout_cache': cache_info()}
+
+
+def main_batch(jobs, workers=1):
+    """
+    Scrape every job in one crawl, then render them shortest predicted first, on `workers` memory capped
+    processes when there is more than one. Each idle worker takes the next job in that order.
+    """
+    model = CostModel()
+    scheduler = JobScheduler(model)
+
+    with Inventory() as inventory:
+        for idx, job in enumerate(jobs):
+            job.setdefault('job_id', f'job-{idx}')
+            job.setdefault('spider_name', domain_detector(job['ad_link']))
+            job['features'] = job_features(job, inventory.latest_by_link(job['ad_link']))
+            scheduler.push(job, job['features'])
+
+    with STAGE_SECONDS.time(stage='scrape'):
+        cars = calling_spider_batch(jobs)
+
+    with Inventory() as inventory:
+        inventory.add_many((cars[job['job_id']], job['ad_link']) for job in jobs if job['job_id'] in cars)
+
+    # cheapest quotes first so small jobs aren't stuck behind big galleries
+    tasks = []
+    while scheduler:
+        job = scheduler.pop()
+        car_data = cars.get(job['job_id'])
+        if car_data is None:
+            SCRAPE_FAILURES.inc(marketplace=job['spider_name'])
+            print(f"{job['job_id']}: nothing scraped from {job['ad_link']}")
+            continue
+        tasks.append({'job_id': job['job_id'], 'api_data': car_data, 'input_data': job})
+
+    def rendered():
+        if workers <= 1:
+            for task in tasks:
+                yield None, render_batch_job(task)
+            return
+        # allocation tracing is for chasing leaks, not needed per batch job
+        for kind, pid, *payload in run_jobs(tasks, workers, render_batch_job, trace=False):
+            if kind == 'done':
+                yield pid, payload[0]
+            elif kind in ('failed', 'killed'):
+                print(f'{payload[0]}: {kind} ({payload[1]})')
+
+    WORKER_RSS.set_function(rss_bytes, worker='main')
+    by_id = {task['job_id']: task for task in tasks}
+    worker_caches = {}
+    QUEUE_DEPTH.set(len(tasks))
+    with QuoteArchive() as archive:
+        for done, (pid, result) in enumerate(rendered(), 1):
+            task = by_id[result['job_id']]
+            size = os.path.getsize(result['filename'])
+            model.record(task['input_data']['features'], result['stages'], size)
+            archive.put(result['filename'], task['api_data'], task['input_data'])
+
+            if pid is not None:
+                # counted on the worker, in-process renders counted here already
+                merge_metrics(result['metrics'])
+                # a worker's layout caches live as long as the worker, keep its latest totals
+                worker_caches[pid] = result['layout_cache']
+            for stage, seconds in result['stages'].items():
+                STAGE_SECONDS.observe(seconds, stage=stage)
+            QUOTES.inc()
+            PDF_BYTES.observe(size)
+            QUEUE_DEPTH.set(len(tasks) - done)
+            write_metrics()
+
+    QUEUE_DEPTH.set(0)
+    write_metrics()
+    model.fit()
+    model.save()
+    print_cache_info(combine_cache_info(worker_caches.values()) if worker_caches else None)
 
 
 if __name__ == "__main__":
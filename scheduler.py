@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+import heapq
+import itertools
+import json
+import os
+import time
+from contextlib import contextmanager
+
+# prior coefficients for [1, images, features, cached], used until enough jobs have been recorded
+DEFAULT_SECONDS = [1.5, 0.35, 0.004, -1.0]
+DEFAULT_BYTES = [60_000, 45_000, 40, 0]
+MIN_SAMPLES = 8
+
+
+def job_features(job, car_data=None):
+    """
+    [1, images, features, cached] of a job (input_data), car_data is the inventory copy when the car is cached
+    """
+    images = len(job.get('img_index') or (car_data or {}).get('car_images') or ())
+    features = len(car_data['car_features']) if car_data is not None else 40
+    return [1.0, float(images), float(features), 1.0 if car_data is not None else 0.0]
+
+
+def solve(matrix, vector):
+    """
+    Gaussian elimination with partial pivoting, small dense systems only
+    """
+    n = len(vector)
+    rows = [list(row) + [value] for row, value in zip(matrix, vector)]
+    for col in range(n):
+        pivot = max(range(col, n), key=lambda r: abs(rows[r][col]))
+        if abs(rows[pivot][col]) < 1e-12:
+            raise ValueError('singular system')
+        rows[col], rows[pivot] = rows[pivot], rows[col]
+        for r in range(n):
+            if r != col:
+                factor = rows[r][col] / rows[col][col]
+                rows[r] = [a - factor * b for a, b in zip(rows[r], rows[col])]
+    return [rows[i][n] / rows[i][i] for i in range(n)]
+
+
+def least_squares(xs, ys, ridge=1e-3):
+    n = len(xs[0])
+    xtx = [[sum(x[i] * x[j] for x in xs) + (ridge if i == j else 0) for j in range(n)] for i in range(n)]
+    xty = [sum(x[i] * y for x, y in zip(xs, ys)) for i in range(n)]
+    return solve(xtx, xty)
+
+
+class CostModel:
+    """
+    Linear model of render time and output size, calibrated from recorded stage timings and kept in a JSON file
+    """
+
+    def __init__(self, path='api/cost_model.json', max_samples=2000):
+        self.path = path
+        self.max_samples = max_samples
+        self.samples = []
+        self.seconds_coef = list(DEFAULT_SECONDS)
+        self.bytes_coef = list(DEFAULT_BYTES)
+        if path and os.path.exists(path):
+            with open(path) as data:
+                self.samples = json.load(data)['samples']
+            self.fit()
+
+    def record(self, features, stages, output_bytes):
+        """
+        stages is {stage: seconds} as collected by StageTimer
+        """
+        self.samples.append({'features': features, 'seconds': sum(stages.values()), 'stages': stages,
+                             'bytes': output_bytes})
+        self.samples = self.samples[-self.max_samples:]
+
+    def fit(self):
+        if len(self.samples) < MIN_SAMPLES:
+            return
+        xs = [sample['features'] for sample in self.samples]
+        try:
+            self.seconds_coef = least_squares(xs, [sample['seconds'] for sample in self.samples])
+            self.bytes_coef = least_squares(xs, [sample['bytes'] for sample in self.samples])
+        except ValueError:
+            pass
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path, 'w') as data:
+            json.dump({'samples': self.samples}, data)
+
+    def predict(self, features):
+        seconds = sum(c * x for c, x in zip(self.seconds_coef, features))
+        size = sum(c * x for c, x in zip(self.bytes_coef, features))
+        return max(seconds, 0.05), max(int(size), 0)
+
+
+class StageTimer:
+    def __init__(self):
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - started
+
+
+class JobScheduler:
+    """
+    Shortest predicted job first, with aging: every second a job waits counts as aging seconds off its cost, so
+    big jobs still get their turn during long batches. The aging term only depends on the enqueue time, which keeps
+    the order static and a heap enough.
+    """
+
+    def __init__(self, model, aging=0.5):
+        self.model = model
+        self.aging = aging
+        self.heap = []
+        self.counter = itertools.count()
+
+    def __len__(self):
+        return len(self.heap)
+
+    def push(self, job, features, now=None):
+        seconds, size = self.model.predict(features)
+        job['predicted_seconds'], job['predicted_bytes'] = round(seconds, 3), size
+        key = seconds + self.aging * (now if now is not None else time.monotonic())
+        heapq.heappush(self.heap, (key, next(self.counter), job))
+
+    def pop(self):
+        return heapq.heappop(self.heap)[2]
+
@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+"""
+Listing extraction from the JSON the marketplaces embed in their pages (JSON-LD and the app state of the page),
+one JSON parse per listing. Spiders try extract_listing() first and fall back to their selectors when it returns
+None:
+
+    def parse(self, response):
+        car_data = extract_listing(response.text, self.name, response.url, self.img_idx)
+        if car_data is None:
+            car_data = self.parse_with_selectors(response)
+        yield car_data
+
+Offline benchmark against saved pages:
+
+    python structured_data.py SuchenMobileDe pages/*.html
+"""
+import collections
+import json
+import re
+import sys
+import time
+
+from text_normalize import normalize_item
+
+JSON_LD_RE = re.compile(r'<script[^>]+type=["\']application/ld\+json["\'][^>]*>(.*?)</script>', re.S | re.I)
+NEXT_DATA_RE = re.compile(r'<script[^>]+id=["\']__NEXT_DATA__["\'][^>]*>(.*?)</script>', re.S | re.I)
+INITIAL_STATE_RE = re.compile(r'window\.__INITIAL_STATE__\s*=\s*')
+
+CAR_TYPES = ('Car', 'Vehicle', 'MotorizedBicycle', 'Product')
+
+# schema.org Vehicle properties shown in the specifications table
+JSON_LD_SPECS = (
+    ('Mileage', 'mileageFromOdometer'),
+    ('First registration', 'dateVehicleFirstRegistered'),
+    ('Fuel', 'fuelType'),
+    ('Transmission', 'vehicleTransmission'),
+    ('Power', 'vehicleEngine'),
+    ('Body type', 'bodyType'),
+    ('Colour', 'color'),
+    ('Doors', 'numberOfDoors'),
+    ('Seats', 'seatingCapacity'),
+)
+
+# where each marketplace keeps the ad in its app state, tried in order before searching the whole state for it.
+# The benchmark below prints which path matched, run it on freshly saved listing pages whenever a marketplace
+# redesigns and add the paths it reports
+STATE_PATHS = {
+    'SuchenMobileDe': (('search', 'vip', 'ad'), ('ad',)),
+    'AutoScout24De': (('props', 'pageProps', 'listingDetails'), ('props', 'pageProps', 'listing')),
+}
+
+# an ad in the app state has a price and a gallery under one of these keys
+AD_PRICE_KEYS = ('price', 'prices')
+AD_IMAGE_KEYS = ('galleryImages', 'images')
+
+AD_ID_RE = re.compile(r'/(\d{6,})\.html|([0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})', re.I)
+
+
+def json_ld_objects(html):
+    for match in JSON_LD_RE.finditer(html):
+        try:
+            data = json.loads(match.group(1))
+        except ValueError:
+            continue
+        for item in data if isinstance(data, list) else [data]:
+            if isinstance(item, dict):
+                yield from item.get('@graph', [item])
+
+
+def app_state(html):
+    match = NEXT_DATA_RE.search(html)
+    if match:
+        try:
+            return json.loads(match.group(1))
+        except ValueError:
+            pass
+
+    match = INITIAL_STATE_RE.search(html)
+    if match:
+        try:
+            return json.JSONDecoder().raw_decode(html, match.end())[0]
+        except ValueError:
+            pass
+    return None
+
+
+def _dig(data, path):
+    for key in path:
+        if not isinstance(data, dict) or key not in data:
+            return None
+        data = data[key]
+    return data
+
+
+def _text(value):
+    """
+    Display text of a JSON-LD value: QuantitativeValue, EngineSpecification or plain
+    """
+    if isinstance(value, dict):
+        if 'value' in value:
+            return ' '.join(str(part) for part in (value['value'], value.get('unitText') or value.get('unitCode', ''))
+                            if part != '')
+        if 'enginePower' in value:
+            return _text(value['enginePower'])
+        return value.get('name')
+    if isinstance(value, list):
+        return ', '.join(filter(None, (_text(item) for item in value)))
+    return value
+
+
+def _image_url(image):
+    if isinstance(image, dict):
+        return image.get('contentUrl') or image.get('url') or image.get('src') or image.get('uri')
+    return image
+
+
+def from_json_ld(item):
+    offers = item.get('offers') or {}
+    if isinstance(offers, list):
+        offers = offers[0] if offers else {}
+
+    images = item.get('image') or []
+    features = item.get('additionalProperty') or []
+    return {
+        'car_price': offers.get('price'),
+        'car_images': [_image_url(image) for image in (images if isinstance(images, list) else [images])],
+        # PropertyValues: the name is the feature, a false value means the car doesn't have it
+        'car_features': [feature.get('name') if isinstance(feature, dict) else _text(feature) for feature in features
+                         if not isinstance(feature, dict) or feature.get('value') is not False],
+        'car_specifications': [[label, _text(item[key])] for label, key in JSON_LD_SPECS if item.get(key)],
+        'car_id': item.get('sku') or item.get('productID') or item.get('vehicleIdentificationNumber'),
+    }
+
+
+def from_app_state(ad):
+    price = ad.get('price') or ad.get('prices') or {}
+    if isinstance(price, dict):
+        price = (price.get('grossAmount') or price.get('amount') or price.get('priceRaw') or
+                 _dig(price, ('public', 'priceRaw')))
+
+    images = ad.get('galleryImages') or ad.get('images') or []
+    features = ad.get('features') or ad.get('equipment') or []
+    if isinstance(features, dict):
+        features = [feature for group in features.values() for feature in group]
+
+    specs = ad.get('attributes') or ad.get('vehicleDetails') or []
+    return {
+        'car_price': price,
+        'car_images': [_image_url(image) for image in images],
+        'car_features': [feature.get('name', feature.get('label')) if isinstance(feature, dict) else feature
+                         for feature in features],
+        'car_specifications': [[spec.get('label'), spec.get('value')] for spec in specs if isinstance(spec, dict)],
+        'car_id': ad.get('id'),
+    }
+
+
+def _price(value):
+    """
+    Plain number string of a JSON price: 23990, 23990.0 and German formatted '23.990 €' all become '23990'
+    """
+    if isinstance(value, (int, float)):
+        return str(int(value)) if float(value).is_integer() else str(value)
+    value = re.sub(r'[^\d,.]', '', str(value))
+    if ',' in value or re.fullmatch(r'\d{1,3}(\.\d{3})+', value):
+        value = value.replace('.', '').replace(',', '.')
+    return value
+
+
+def _complete(car_data):
+    return car_data['car_price'] not in (None, '') and car_data['car_images']
+
+
+def _is_ad(node):
+    if not (any(key in node for key in AD_PRICE_KEYS) and
+            any(isinstance(node.get(key), list) for key in AD_IMAGE_KEYS)):
+        return False
+    try:
+        return bool(_complete(from_app_state(node)))
+    except (AttributeError, TypeError):
+        return False
+
+
+def search_ad(state, ad_id=None):
+    """
+    Breadth first search of state for a complete ad, the one with id ad_id when given (similar ads and dealer
+    listings sit in the same state). Returns (path, ad) or (None, None).
+    """
+    first = (None, None)
+    pending = collections.deque([((), state)])
+    while pending:
+        path, node = pending.popleft()
+        if isinstance(node, dict):
+            if _is_ad(node):
+                if ad_id is None or str(node.get('id')) == ad_id:
+                    return path, node
+                first = first if first[0] is not None else (path, node)
+            children = node.items()
+        elif isinstance(node, list):
+            children = enumerate(node)
+        else:
+            continue
+        pending.extend((path + (key,), value) for key, value in children if isinstance(value, (dict, list)))
+
+    # no ad carries the id of the link, only trust a lone candidate
+    return first if ad_id is None else (None, None)
+
+
+def state_path(state, spider_name, ad_id=None):
+    """
+    First of the STATE_PATHS of spider_name that holds a complete ad in state, or the ad search_ad() finds when the
+    marketplace moved it. Returns (path, ad), else (None, None).
+    """
+    for path in STATE_PATHS.get(spider_name, ()):
+        ad = _dig(state, path)
+        if isinstance(ad, dict) and _complete(from_app_state(ad)):
+            return path, ad
+    return search_ad(state, ad_id)
+
+
+def ad_id_of(ad_link):
+    match = AD_ID_RE.search(ad_link)
+    return (match.group(1) or match.group(2)) if match else None
+
+
+def extract_listing(html, spider_name, ad_link='', img_idx=None):
+    """
+    car_data of a listing page from its embedded JSON, or None when the page has no usable payload. img_idx picks
+    gallery photos by their position counted from 1, as the image index prompt asks for them, as ints or as the
+    strings image_output() returns.
+    """
+    car_data = None
+    ad_id = ad_id_of(ad_link)
+    _, ad = state_path(app_state(html), spider_name, ad_id)
+    if ad is not None:
+        car_data = from_app_state(ad)
+
+    if car_data is None:
+        for item in json_ld_objects(html):
+            item_type = item.get('@type')
+            if any(kind in CAR_TYPES for kind in (item_type if isinstance(item_type, list) else [item_type])):
+                car_data = from_json_ld(item)
+                if _complete(car_data):
+                    break
+                car_data = None
+
+    if car_data is None:
+        return None
+
+    car_data['car_images'] = [url for url in car_data['car_images'] if url]
+    if img_idx:
+        car_data['car_images'] = [car_data['car_images'][int(idx) - 1] for idx in img_idx
+                                  if 0 < int(idx) <= len(car_data['car_images'])]
+    car_data['car_features'] = [feature for feature in car_data['car_features'] if feature]
+    car_data['car_specifications'] = [[str(label), str(value)] for label, value in car_data['car_specifications']
+                                      if label and value is not None]
+
+    if not car_data['car_id']:
+        if ad_id is None:
+            # no id to file the quote under, let the spider's selectors have a go
+            return None
+        car_data['car_id'] = ad_id
+    car_data['car_id'] = str(car_data['car_id'])
+    car_data['car_price'] = _price(car_data['car_price'])
+
+    return normalize_item(car_data)
+
+
+def main():
+    spider_name, paths = sys.argv[1], sys.argv[2:]
+    total, found = 0.0, 0
+    for path in paths:
+        with open(path, encoding='utf-8') as page:
+            html = page.read()
+
+        started = time.perf_counter()
+        car_data = extract_listing(html, spider_name, path)
+        elapsed = time.perf_counter() - started
+        total += elapsed
+        found += car_data is not None
+
+        if car_data is None:
+            print(f'{path}: no structured data, selector fallback needed')
+        else:
+            source = state_path(app_state(html), spider_name, ad_id_of(path))[0]
+            if source is None:
+                source = 'JSON-LD'
+            else:
+                known = source in STATE_PATHS.get(spider_name, ())
+                source = '.'.join(map(str, source)) + ('' if known else ' (found by search, not in STATE_PATHS)')
+            print(f"{path}: {source}, {elapsed * 1000:.2f} ms, price {car_data['car_price']}, {len(car_data['car_images'])} "
+                  f"images, {len(car_data['car_features'])} features, {len(car_data['car_specifications'])} specs")
+
+    if paths:
+        print(f'{found}/{len(paths)} pages from structured data, {total / len(paths) * 1000:.2f} ms per page')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+from helper import NUMBER_RE, remove_unicode_char
+
+# joins a whole field into one string so each pass over it is a single C call
+SEPARATOR = '\x00'
+
+
+def _joinable(values):
+    return not any(SEPARATOR in value for value in values)
+
+
+def remove_white_spaces_many(values):
+    """
+    remove_white_spaces over a list of strings with one split/join pass
+    """
+    values = [str(value) for value in values]
+    if not values:
+        return []
+    if not _joinable(values):
+        return [' '.join(value.split()) for value in values]
+
+    return [value.strip() for value in ' '.join(SEPARATOR.join(values).split()).split(SEPARATOR)]
+
+
+def remove_unicode_char_many(values):
+    """
+    remove_unicode_char over a list of strings with one ascii encode pass
+    """
+    values = [str(value) for value in values]
+    if not values:
+        return []
+
+    joined = SEPARATOR.join(values)
+    if joined.isascii():
+        return [value.strip() for value in values]
+    if not _joinable(values):
+        return [remove_unicode_char(value) for value in values]
+
+    joined = joined.encode('ascii', 'non_ascii_to_space').decode('ascii')
+    return [value.strip() for value in joined.split(SEPARATOR)]
+
+
+def extract_number_only_many(values):
+    return [NUMBER_RE.findall(str(value)) or 0 for value in values]
+
+
+def normalize_item(item, ascii_only=False):
+    """
+    Clean every text field of a scraped item in bulk, features and specifications are each one pass
+    """
+    clean = remove_unicode_char_many if ascii_only else remove_white_spaces_many
+
+    item = dict(item)
+    if item.get('car_features'):
+        item['car_features'] = [feature for feature in clean(item['car_features']) if feature]
+
+    if item.get('car_specifications'):
+        cells = iter(clean([cell for row in item['car_specifications'] for cell in row]))
+        item['car_specifications'] = [[next(cells) for _ in row] for row in item['car_specifications']]
+
+    if isinstance(item.get('car_price'), str):
+        item['car_price'] = ''.join(item['car_price'].split())
+
+    return item
+
+
+def normalize_items(items, ascii_only=False):
+    return [normalize_item(item, ascii_only) for item in items]
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+import hashlib
+import json
+import time
+import urllib.request
+
+from helper import domain_detector
+from inventory import Inventory
+from pdf_generator import PdfGenerator
+from quote_archive import QuoteArchive
+from rate_limiter import RateLimiter
+from run import crawl_in_subprocess, download_image
+
+WATCH_SCHEMA = """
+CREATE TABLE IF NOT EXISTS watch (
+    ad_link TEXT PRIMARY KEY,
+    input_data TEXT NOT NULL,
+    car_id TEXT,
+    fingerprint TEXT,
+    etag TEXT,
+    interval REAL NOT NULL,
+    next_check REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS watch_next_check ON watch (next_check);
+"""
+
+
+def fingerprint(car_data):
+    """
+    Hash of the fields that change a quote: price, images and specifications
+    """
+    payload = json.dumps([str(car_data['car_price']), list(car_data['car_images']),
+                          [list(row) for row in car_data['car_specifications']]])
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+
+def listing_etag(ad_link, timeout=10):
+    # HEAD requests count against the marketplace's budget like the crawls
+    with RateLimiter() as limiter:
+        limiter.acquire(ad_link)
+
+    request = urllib.request.Request(ad_link, method='HEAD', headers={'User-Agent': 'Mozilla/5.0'})
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.headers.get('ETag')
+    except OSError:
+        return None
+
+
+class Watcher:
+    """
+    Keeps a watch list of ad links and rescrapes each one on its own interval. The interval halves when a
+    listing changes and doubles when it doesn't, within min_interval and max_interval (seconds).
+    """
+
+    def __init__(self, inventory_path='api/inventory.db', min_interval=15 * 60, max_interval=24 * 3600,
+                 use_etag=True):
+        self.inventory = Inventory(inventory_path)
+        self.conn = self.inventory.conn
+        self.conn.executescript(WATCH_SCHEMA)
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.use_etag = use_etag
+
+    def add(self, input_data):
+        with self.conn:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO watch (ad_link, input_data, interval, next_check) VALUES (?, ?, ?, ?)',
+                (input_data['ad_link'], json.dumps(input_data), self.min_interval, time.time()))
+
+    def remove(self, ad_link):
+        with self.conn:
+            self.conn.execute('DELETE FROM watch WHERE ad_link = ?', (ad_link,))
+
+    def due(self, now=None):
+        rows = self.conn.execute(
+            'SELECT ad_link, input_data, fingerprint, etag, interval FROM watch WHERE next_check <= ? '
+            'ORDER BY next_check', (now or time.time(),))
+        return [dict(zip(('ad_link', 'input_data', 'fingerprint', 'etag', 'interval'), row)) for row in rows]
+
+    def _reschedule(self, ad_link, changed, interval, **columns):
+        if changed:
+            interval = max(self.min_interval, interval / 2)
+        else:
+            interval = min(self.max_interval, interval * 2)
+
+        columns.update(interval=interval, next_check=time.time() + interval)
+        assignments = ', '.join(f'{column} = ?' for column in columns)
+        with self.conn:
+            self.conn.execute(f'UPDATE watch SET {assignments} WHERE ad_link = ?', (*columns.values(), ad_link))
+
+    def run_once(self, now=None):
+        """
+        Rescrape the due listings, regenerate quotes for the changed ones and return their car_ids
+        """
+        jobs = []
+        for row in self.due(now):
+            if self.use_etag and row['etag']:
+                etag = listing_etag(row['ad_link'])
+                if etag == row['etag']:
+                    self._reschedule(row['ad_link'], False, row['interval'])
+                    continue
+
+            job = json.loads(row['input_data'])
+            job.update(job_id=row['ad_link'], spider_name=domain_detector(row['ad_link']), watch=row)
+            jobs.append(job)
+
+        if not jobs:
+            return []
+
+        try:
+            cars = crawl_in_subprocess([{k: v for k, v in job.items() if k != 'watch'} for job in jobs])
+        except (RuntimeError, TimeoutError) as error:
+            print(f'Crawl failed: {error}')
+            cars = {}
+
+        changed = []
+        for job in jobs:
+            row = job.pop('watch')
+            car_data = cars.get(job['job_id'])
+            if car_data is None:
+                self._reschedule(row['ad_link'], False, row['interval'])
+                continue
+
+            new_fingerprint = fingerprint(car_data)
+            etag = listing_etag(row['ad_link']) if self.use_etag else None
+            if new_fingerprint == row['fingerprint']:
+                self._reschedule(row['ad_link'], False, row['interval'], etag=etag)
+                continue
+
+            self.inventory.add(car_data, ad_link=row['ad_link'])
+            download_image(images=car_data['car_images'])
+            api_data = self.inventory.latest(car_data['car_id'])
+            pdf = PdfGenerator(api_data=api_data, input_data=job)
+            with QuoteArchive() as archive:
+                archive.put(pdf.filename, api_data, job)
+            self._reschedule(row['ad_link'], True, row['interval'], car_id=car_data['car_id'],
+                             fingerprint=new_fingerprint, etag=etag)
+            changed.append(car_data['car_id'])
+
+        return changed
+
+    def loop(self):
+        while True:
+            changed = self.run_once()
+            if changed:
+                print(f"Requoted: {', '.join(changed)}")
+
+            next_check = self.conn.execute('SELECT MIN(next_check) FROM watch').fetchone()[0]
+            time.sleep(max(1, (next_check or time.time() + self.min_interval) - time.time()))
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+import collections
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import tracemalloc
+
+from metrics import WORKER_RSS
+from pdf_generator import PdfGenerator
+
+MB = 1024 * 1024
+
+
+def rss_bytes():
+    """
+    Resident set size of this process, from /proc (Linux)
+    """
+    with open('/proc/self/statm') as statm:
+        return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+class MemoryBudget:
+    """
+    Samples RSS and tracemalloc around each job. Crossing soft_limit asks the worker to recycle after the current
+    job, crossing hard_limit or finishing max_jobs does too. Sizes are in bytes.
+    """
+
+    def __init__(self, soft_limit=512 * MB, hard_limit=1024 * MB, max_jobs=200, top_allocations=5, trace=True):
+        self.soft_limit = soft_limit
+        self.hard_limit = hard_limit
+        self.max_jobs = max_jobs
+        self.top_allocations = top_allocations
+        self.trace = trace
+        self.jobs_done = 0
+        self.peak_rss = 0
+        if trace and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def measure(self, job, *args, **kwargs):
+        """
+        Run job(*args, **kwargs) and return (result, report), report holds the RSS before/after and the allocation
+        sites that grew the most during the job
+        """
+        before_rss = rss_bytes()
+        before = tracemalloc.take_snapshot() if self.trace else None
+
+        result = job(*args, **kwargs)
+
+        after_rss = rss_bytes()
+        self.peak_rss = max(self.peak_rss, after_rss)
+        self.jobs_done += 1
+
+        report = {'rss_before': before_rss, 'rss_after': after_rss, 'rss_growth': after_rss - before_rss}
+        if self.trace:
+            growth = tracemalloc.take_snapshot().compare_to(before, 'lineno')
+            report['top_growth'] = [(str(stat.traceback[0]), stat.size_diff) for stat in growth[:self.top_allocations]
+                                    if stat.size_diff > 0]
+        return result, report
+
+    def should_recycle(self):
+        rss = rss_bytes()
+        if rss >= self.hard_limit:
+            return 'hard_limit'
+        if rss >= self.soft_limit:
+            return 'soft_limit'
+        if self.jobs_done >= self.max_jobs:
+            return 'max_jobs'
+        return None
+
+
+def render_job(job):
+    PdfGenerator(api_data=job['api_data'], input_data=job['input_data'], **job.get('options', {}))
+    return job['api_data']['car_id']
+
+
+def _watchdog(budget, current, results, interval=0.5):
+    """
+    Kills the worker as soon as RSS crosses the hard limit in the middle of a job, instead of waiting for the OOM killer
+    """
+    while True:
+        time.sleep(interval)
+        rss = rss_bytes()
+        # between jobs the worker checks the limits itself and retires cleanly
+        if current.get('busy') and rss >= budget.hard_limit:
+            results.put(('killed', os.getpid(), current.get('job_id'), rss))
+            results.close()
+            results.join_thread()
+            os._exit(1)
+
+
+def _worker(inbox, results, budget_kwargs, handler):
+    budget = MemoryBudget(**budget_kwargs)
+    current = {}
+    threading.Thread(target=_watchdog, args=(budget, current, results), daemon=True).start()
+
+    while True:
+        job = inbox.get()
+        if job is None:
+            return
+
+        current['job_id'] = job.get('job_id')
+        current['busy'] = True
+        try:
+            result, report = budget.measure(handler, job)
+            results.put(('done', os.getpid(), result, report))
+        except Exception as error:
+            results.put(('failed', os.getpid(), job.get('job_id'), repr(error)))
+        current['busy'] = False
+        current['job_id'] = None
+
+        reason = budget.should_recycle()
+        if reason:
+            results.put(('recycle', os.getpid(), reason, rss_bytes()))
+            return
+        results.put(('idle', os.getpid()))
+
+
+def run_jobs(jobs, workers=os.cpu_count(), handler=render_job, **budget_kwargs):
+    """
+    Run jobs on worker processes that are replaced whenever they hit their memory limits or job count.
+    Yields ('done', pid, result, report), ('failed', pid, job_id, error) or ('killed', pid, job_id, rss) per job,
+    plus ('recycle', pid, reason, rss) whenever a worker retires between jobs. A worker that dies without a word
+    (OOM killer, segfault) is reported as killed with rss None.
+    """
+    pending = collections.deque(jobs)
+    results = multiprocessing.Queue()
+    remaining = len(pending)
+
+    # each worker gets one job at a time, so the job a dead worker took down is always known
+    processes = {}
+    inboxes = {}
+    running = {}
+
+    def start_worker():
+        inbox = multiprocessing.SimpleQueue()
+        process = multiprocessing.Process(target=_worker, args=(inbox, results, budget_kwargs, handler))
+        process.start()
+        processes[process.pid] = process
+        inboxes[process.pid] = inbox
+        dispatch(process.pid)
+
+    def dispatch(pid):
+        if pending:
+            job = pending.popleft()
+            running[pid] = job.get('job_id')
+            inboxes[pid].put(job)
+
+    def retire(pid):
+        WORKER_RSS.remove(worker=pid)
+        running.pop(pid, None)
+        inboxes.pop(pid).close()
+        processes.pop(pid).join()
+        if pending:
+            start_worker()
+
+    for _ in range(min(workers, remaining)):
+        start_worker()
+
+    while remaining:
+        try:
+            kind, pid, *payload = results.get(timeout=0.5)
+        except queue.Empty:
+            for pid, process in list(processes.items()):
+                if not process.is_alive():
+                    busy, job_id = pid in running, running.get(pid)
+                    retire(pid)
+                    if busy:
+                        remaining -= 1
+                        yield ('killed', pid, job_id, None)
+            continue
+
+        if pid not in processes:
+            # late event from a worker already retired
+            continue
+        if kind == 'idle':
+            dispatch(pid)
+            continue
+
+        if kind in ('done', 'failed', 'killed'):
+            running.pop(pid, None)
+        if kind == 'done':
+            WORKER_RSS.set(payload[1]['rss_after'], worker=pid)
+        if kind in ('recycle', 'killed'):
+            retire(pid)
+        if kind != 'recycle':
+            remaining -= 1
+        yield (kind, pid, *payload)
+
+    for pid, inbox in inboxes.items():
+        inbox.put(None)
+    for process in processes.values():
+        process.join()